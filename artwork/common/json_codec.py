@@ -0,0 +1,81 @@
+"""JSON编解码
+安装了orjson时使用orjson,否则使用标准库json.
+datetime与Decimal的输出格式与Common.to_dict_一致,可直接编码未经转换的模型字段值.
+"""
+import json
+import uuid
+import decimal
+import datetime
+from collections.abc import Mapping
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'  # 与Common.to_dict_一致
+
+backend = 'orjson' if orjson is not None else 'json'
+
+
+def default(value):
+    """标准库json与orjson都无法直接编码的类型"""
+    if isinstance(value, datetime.datetime):
+        return value.strftime(DATETIME_FORMAT)
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    if isinstance(value, Mapping):
+        return dict(value)  # 例如只读的UserInfo
+    raise TypeError(f'Object of type {value.__class__.__name__} is not JSON serializable')
+
+
+if orjson is not None:
+    _ORJSON_OPTION = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+# 数字统一替换为0,数值前可能出现的结构字符与空白统一替换为逗号
+_DIGITS = bytes.maketrans(b'123456789[: \n\t\r', b'000000000,,,,,,')
+_LONG_NUMBER = b'0' * 19  # 2**63有19位
+_BARE_LONG_NUMBER = b',' + _LONG_NUMBER
+_BARE_NEGATIVE_LONG_NUMBER = b',-' + _LONG_NUMBER
+
+
+def dumps_bytes(obj) -> bytes:
+    """编码为utf-8 bytes,用于响应体"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=default, option=_ORJSON_OPTION)
+        except orjson.JSONEncodeError:
+            pass  # 超过64位的整数等orjson不支持的值,使用标准库编码
+    return json.dumps(obj, default=default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def dumps(obj) -> str:
+    """编码为str,非ASCII字符不转义"""
+    return dumps_bytes(obj).decode('utf-8')
+
+
+def _has_long_number(data) -> bool:
+    """是否包含19位及以上的数值
+    替换字符后查找结构字符之后的连续数字,比正则快一个数量级.
+    字符串中的长数字(例如订单号)前面是引号,不会命中
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8', 'surrogatepass')
+    data = b',' + data.translate(_DIGITS)
+    return _BARE_LONG_NUMBER in data or _BARE_NEGATIVE_LONG_NUMBER in data
+
+
+def loads(data):
+    """解码,参数可以是str或bytes
+    orjson将超过64位的整数解析为float,丢失精度,包含19位以上数值的数据使用标准库解码.
+    字符串中的长数字(例如订单号)不会导致回退.
+    """
+    if orjson is not None and not _has_long_number(data):
+        return orjson.loads(data)
+    return json.loads(data)
@@ -0,0 +1,209 @@
+"""外部网关调用统计
+按操作名记录耗时直方图(p50/p95/p99),返回码计数与请求/响应大小,
+可导出Prometheus文本格式,或通过回调逐次获取调用记录用于链路追踪.
+单次记录为一次二分查找加计数,可在生产环境常开.
+示例:
+    with metrics.gateway.span('alipay.trade_query') as span:
+        response = http.get(url, params=params)
+        span.code = response.status_code
+        span.response_bytes = len(response.content)
+"""
+import time
+import bisect
+import logging
+import threading
+from collections import Counter
+
+# 耗时直方图桶上限,秒: 1ms ~ 60s 按约1.5倍递增
+LATENCY_BUCKETS = (0.001, 0.002, 0.003, 0.005, 0.0075, 0.01, 0.015, 0.025, 0.04, 0.06, 0.1, 0.15, 0.25,
+                   0.4, 0.6, 1, 1.5, 2.5, 4, 6, 10, 15, 25, 40, 60)
+
+logger = logging.getLogger(__name__)
+
+
+class Histogram:
+    """固定桶直方图,分位数按桶内线性插值估算"""
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最后一个为+Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """估算分位数,没有数据时返回0"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                lower = self.buckets[index - 1] if index else 0.0
+                if index == len(self.buckets):
+                    return lower  # 超出最大桶,无法插值
+                return lower + (self.buckets[index] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+
+class OperationStats:
+    """单个操作的统计"""
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.codes = Counter()  # {返回码: 次数}
+        self.errors = 0  # 抛出异常的次数
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.lock = threading.Lock()
+
+    def record(self, span):
+        with self.lock:
+            self.latency.observe(span.elapsed)
+            self.codes[span.code] += 1
+            if span.error is not None:
+                self.errors += 1
+            self.request_bytes += span.request_bytes
+            self.response_bytes += span.response_bytes
+
+
+class Span:
+    """一次网关调用记录,调用方在with块内设置返回码与大小
+    未设置返回码时,正常结束记为OK,抛出异常记为异常的error_code或类名
+    """
+    __slots__ = ('operation', 'start', 'elapsed', 'code', 'error', 'request_bytes', 'response_bytes')
+
+    def __init__(self, operation: str):
+        self.operation = operation
+        self.start = time.time()
+        self.elapsed = 0.0
+        self.code = ''
+        self.error = None
+        self.request_bytes = 0
+        self.response_bytes = 0
+
+
+class _SpanContext:
+    __slots__ = ('metrics', 'span', '_begin')
+
+    def __init__(self, metrics, operation: str):
+        self.metrics = metrics
+        self.span = Span(operation)
+
+    def __enter__(self) -> Span:
+        self._begin = time.perf_counter()
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        span = self.span
+        span.elapsed = time.perf_counter() - self._begin
+        if exc is not None:
+            span.error = exc
+            if not span.code:
+                span.code = getattr(exc, 'error_code', None) or exc_type.__name__
+        elif not span.code:
+            span.code = 'OK'
+        self.metrics.record(span)
+        return False
+
+
+class GatewayMetrics:
+    """网关调用统计"""
+
+    def __init__(self, prefix: str = 'gateway'):
+        """
+        :param prefix: Prometheus指标名前缀
+        """
+        self.prefix = prefix
+        self.enabled = True
+        self._operations = dict()  # {operation: OperationStats}
+        self._callbacks = list()
+        self._lock = threading.Lock()
+
+    def span(self, operation: str) -> _SpanContext:
+        """记录一次调用,with块结束时计时,异常会被记录后继续抛出"""
+        return _SpanContext(self, operation)
+
+    def record(self, span: Span):
+        if not self.enabled:
+            return
+        stats = self._operations.get(span.operation)
+        if stats is None:
+            with self._lock:
+                stats = self._operations.setdefault(span.operation, OperationStats())
+        stats.record(span)
+        for callback in self._callbacks:
+            try:
+                callback(span)
+            except Exception:
+                logger.exception('gateway metrics callback error')
+
+    def add_callback(self, func):
+        """每次调用结束后调用func(span),可用于日志或链路追踪.func抛出的异常只记录日志,不影响网关调用"""
+        self._callbacks.append(func)
+        return func
+
+    def reset(self):
+        with self._lock:
+            self._operations.clear()
+
+    def snapshot(self) -> dict:
+        """当前统计
+        :return: {operation: {'count', 'errors', 'p50', 'p95', 'p99', 'codes', 'request_bytes', 'response_bytes'}}
+        """
+        result = dict()
+        for operation, stats in list(self._operations.items()):
+            with stats.lock:
+                latency = stats.latency
+                result[operation] = {
+                    'count': latency.count,
+                    'errors': stats.errors,
+                    'p50': latency.quantile(0.5),
+                    'p95': latency.quantile(0.95),
+                    'p99': latency.quantile(0.99),
+                    'codes': dict(stats.codes),
+                    'request_bytes': stats.request_bytes,
+                    'response_bytes': stats.response_bytes
+                }
+        return result
+
+    def prometheus(self) -> str:
+        """导出Prometheus文本格式"""
+        name = f'{self.prefix}_request_duration_seconds'
+        lines = [
+            f'# HELP {name} Outbound gateway call latency.',
+            f'# TYPE {name} histogram'
+        ]
+        codes, errors, request_sizes, response_sizes = list(), list(), list(), list()
+        for operation, stats in sorted(self._operations.items()):
+            label = f'operation="{operation}"'
+            with stats.lock:
+                latency = stats.latency
+                cumulative = 0
+                for bound, count in zip(latency.buckets, latency.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{label},le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{{label},le="+Inf"}} {latency.count}')
+                lines.append(f'{name}_sum{{{label}}} {latency.sum}')
+                lines.append(f'{name}_count{{{label}}} {latency.count}')
+                for code, count in sorted(stats.codes.items(), key=lambda x: str(x[0])):
+                    codes.append(f'{self.prefix}_responses_total{{{label},code="{code}"}} {count}')
+                errors.append(f'{self.prefix}_exceptions_total{{{label}}} {stats.errors}')
+                request_sizes.append(f'{self.prefix}_request_bytes_total{{{label}}} {stats.request_bytes}')
+                response_sizes.append(f'{self.prefix}_response_bytes_total{{{label}}} {stats.response_bytes}')
+
+        lines += [f'# HELP {self.prefix}_responses_total Outbound gateway calls by response code.',
+                  f'# TYPE {self.prefix}_responses_total counter'] + codes
+        lines += [f'# HELP {self.prefix}_exceptions_total Outbound gateway calls that raised.',
+                  f'# TYPE {self.prefix}_exceptions_total counter'] + errors
+        lines += [f'# TYPE {self.prefix}_request_bytes_total counter'] + request_sizes
+        lines += [f'# TYPE {self.prefix}_response_bytes_total counter'] + response_sizes
+        return '\n'.join(lines) + '\n'
+
+
+gateway = GatewayMetrics()
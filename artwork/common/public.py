@@ -1,15 +1,123 @@
 """公开的随处可用的通用方法"""
-import random
+import os
+import math
+import time
+import hashlib
+import base64
+import secrets
+import decimal
 import datetime
-from flask import jsonify
+import threading
+import weakref
+import warnings
+from collections import OrderedDict
+from flask import current_app, stream_with_context
+from artwork.common import error, json_codec
+
+
+ORDER_ID_WORKER_ENV = 'ORDER_ID_WORKER_ID'  # 进程编号环境变量
+
+
+class OrderIdGenerator:
+    """订单编号生成器(Snowflake方式)
+    编号格式: 年月日时分秒(14位) + 毫秒(3位) + 进程编号(4位) + 毫秒内序号(3位),共24位数字
+    与旧格式长度一致,按时间排序.线程安全,时钟回拨时沿用上一次的时间继续递增.
+    只有各进程的进程编号不同时才不会产生重复编号,进程编号按以下顺序确定:
+        1. 构造参数worker_id或init_order_id(),只对当前进程有效,fork后的子进程需要重新设置
+           (例如在gunicorn的post_fork或celery的worker_process_init中调用init_order_id)
+        2. 环境变量ORDER_ID_WORKER_ID,只在未经fork的进程中使用.fork后的子进程继承同一个值,
+           同样需要调用init_order_id重新设置
+        3. 都没有设置时使用pid % 10000,并发出RuntimeWarning.不同容器内的pid通常相同,不能保证唯一
+    """
+
+    _instances = weakref.WeakSet()
+    _forked = False  # 当前进程是否由fork产生,是则不再使用继承的环境变量
+
+    def __init__(self, worker_id: int = None):
+        """
+        :param worker_id: 进程编号0-9999
+        """
+        self._worker_id = self._check_worker_id(worker_id)
+        self._reset()
+        self._instances.add(self)
+
+    @staticmethod
+    def _check_worker_id(worker_id):
+        if worker_id is None:
+            return None
+        worker_id = int(worker_id)
+        if not 0 <= worker_id <= 9999:
+            raise ValueError(f'worker_id must be in 0-9999, got {worker_id}')
+        return worker_id
+
+    def _reset(self):
+        worker_id = self._worker_id
+        if worker_id is None and not OrderIdGenerator._forked:
+            worker_id = self._check_worker_id(os.environ.get(ORDER_ID_WORKER_ENV) or None)
+        self.configured = worker_id is not None
+        self.worker_id = worker_id if worker_id is not None else os.getpid() % 10000
+        self._warned = False
+        self._lock = threading.Lock()
+        self._last_ms = 0
+        self._sequence = 0
+        self._prefix = (None, '')  # (秒, 格式化后的时间前缀)
+
+    def configure(self, worker_id: int):
+        """设置当前进程的进程编号"""
+        self._worker_id = self._check_worker_id(worker_id)
+        self._reset()
+
+    @classmethod
+    def _after_fork(cls):
+        OrderIdGenerator._forked = True  # 环境变量的编号与其他子进程相同
+        for generator in list(cls._instances):
+            generator._worker_id = None  # 父进程设置的编号会与其他子进程重复,子进程需要重新设置
+            generator._reset()
+
+    def generate(self) -> str:
+        """生成订单编号"""
+        if not self.configured and not self._warned:
+            self._warned = True
+            warnings.warn(f'order id worker id is not configured, falling back to pid % 10000 ({self.worker_id}); '
+                          f'call init_order_id() or set {ORDER_ID_WORKER_ENV} to guarantee uniqueness',
+                          RuntimeWarning, stacklevel=2)
+
+        with self._lock:
+            now = int(time.time() * 1000)
+            if now > self._last_ms:
+                self._last_ms = now
+                self._sequence = 0
+            else:
+                # 同一毫秒内或时钟回拨
+                self._sequence += 1
+                if self._sequence > 999:
+                    self._last_ms += 1
+                    self._sequence = 0
+            ms, sequence = self._last_ms, self._sequence
+
+        second, millisecond = divmod(ms, 1000)
+        prefix = self._prefix
+        if prefix[0] != second:
+            prefix = (second, time.strftime('%Y%m%d%H%M%S', time.localtime(second)))
+            self._prefix = prefix
+        return f'{prefix[1]}{millisecond:03d}{self.worker_id:04d}{sequence:03d}'
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=OrderIdGenerator._after_fork)
+
+order_id_generator = OrderIdGenerator()
+
+
+def init_order_id(worker_id: int):
+    """设置当前进程的订单编号进程编号(0-9999),每个进程需要不同的编号,见OrderIdGenerator"""
+    order_id_generator.configure(worker_id)
 
 
 def generate_order_id():
-    """生成订单编号,精度到纳秒+随机数
+    """生成订单编号,见OrderIdGenerator
     """
-    randint = generate_verify_code()
-    time = datetime.datetime.now().strftime("%Y%m%d%H%M%S%f")
-    return time + randint
+    return order_id_generator.generate()
 
 
 def query_order_by(query, model, form, field):
@@ -29,6 +137,231 @@ def query_order_by(query, model, form, field):
     return query
 
 
+def _order_direction(form, field) -> int:
+    """排序方向,与query_order_by一致: 0不排序 1升序 其他降序"""
+    field_data = getattr(form, field).data if field else None
+    if not field_data:
+        return 0
+    return 1 if field_data == 1 else 2
+
+
+def encode_cursor(direction: int, value, ident) -> str:
+    """生成不透明的分页游标,记录上一页最后一条数据的(排序值, id)"""
+    if isinstance(value, datetime.datetime):
+        value = {'dt': value.isoformat()}
+    elif isinstance(value, datetime.date):
+        value = {'d': value.isoformat()}
+    elif isinstance(value, datetime.time):
+        value = {'t': value.isoformat()}
+    elif isinstance(value, decimal.Decimal):
+        value = {'dec': str(value)}
+    data = json_codec.dumps_bytes([direction, value, ident])
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """解析分页游标
+    :return: (direction, value, id)
+    """
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        direction, value, ident = json_codec.loads(data)
+        if isinstance(value, dict):
+            if 'dt' in value:
+                value = datetime.datetime.fromisoformat(value['dt'])
+            elif 'd' in value:
+                value = datetime.date.fromisoformat(value['d'])
+            elif 't' in value:
+                value = datetime.time.fromisoformat(value['t'])
+            elif 'dec' in value:
+                value = decimal.Decimal(value['dec'])
+    except BaseException:
+        raise error.FormException(error_code=1001, message='分页游标错误.')
+    return direction, value, ident
+
+
+class KeysetPage:
+    """游标分页结果"""
+
+    def __init__(self, items: list, next_cursor: str = None, has_more: bool = False):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.has_more = has_more
+
+
+def _nullable(model_field) -> bool:
+    """排序字段是否可为NULL,无法判断时按可为NULL处理"""
+    try:
+        return any(column.nullable for column in model_field.property.columns)
+    except AttributeError:
+        return True
+
+
+def query_keyset(query, model, form, field: str = None) -> KeysetPage:
+    """游标(keyset)分页查询封装方法
+    排序字段与方向沿用query_order_by的表单参数,以id作为第二排序字段保证顺序唯一.
+    可为NULL的排序字段,NULL排在最后.不使用OFFSET,也不统计总数,表单需要继承CursorPage.
+    :param query: 查询对象
+    :param model: 模型
+    :param form: 表单,需要cursor与limit字段
+    :param field: 排序字段名,None为按id升序
+    :return: KeysetPage
+    """
+
+    direction = _order_direction(form, field)
+    model_field = getattr(model, field) if direction else None
+    nullable = direction and _nullable(model_field)
+    cursor = form.cursor.data
+    limit = form.limit.data
+
+    if cursor:
+        cursor_direction, value, ident = decode_cursor(cursor)
+        if cursor_direction != direction:
+            raise error.FormException(error_code=1001, message='分页游标与排序方式不一致.')
+
+        if direction == 0:
+            query = query.filter(model.id > ident)
+        elif value is None:
+            # 已进入排序值为NULL的部分,只按id继续
+            query = query.filter(model_field.is_(None), model.id > ident if direction == 1 else model.id < ident)
+        else:
+            if direction == 1:
+                condition = (model_field > value) | ((model_field == value) & (model.id > ident))
+            else:
+                condition = (model_field < value) | ((model_field == value) & (model.id < ident))
+            if nullable:
+                condition = condition | model_field.is_(None)
+            query = query.filter(condition)
+
+    # 可为NULL的排序字段,NULL统一排在最后,各数据库行为一致
+    null_order = (model_field.is_(None),) if nullable else ()
+    if direction == 0:
+        query = query.order_by(model.id)
+    elif direction == 1:
+        query = query.order_by(*null_order, model_field, model.id)
+    else:
+        query = query.order_by(*null_order, model_field.desc(), model.id.desc())
+
+    items = query.limit(limit + 1).all()  # 多取一条判断是否还有下一页
+    has_more = len(items) > limit
+    items = items[:limit]
+
+    next_cursor = None
+    if has_more:
+        last = items[-1]
+        next_cursor = encode_cursor(direction, getattr(last, field) if direction else None, last.id)
+
+    return KeysetPage(items=items, next_cursor=next_cursor, has_more=has_more)
+
+
+COUNT_CACHE_SIZE = 1024  # 缓存的查询总数数量上限
+COUNT_CACHE_TTL = 10  # 查询总数缓存有效期,秒
+
+
+class CountCache:
+    """查询总数缓存(LRU+TTL),以归一化后的查询语句与参数为键"""
+
+    def __init__(self, maxsize: int = COUNT_CACHE_SIZE, ttl: float = COUNT_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items = OrderedDict()  # {key: (total, expire_at)}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(query) -> str:
+        """查询的缓存键,去掉排序与分页后编译为SQL,参数按名称排序
+        软删除过滤等在执行时才加入语句的条件由执行选项决定(例如with_deleted的include_deleted),执行选项也计入键
+        """
+        compiled = query.order_by(None).limit(None).offset(None).statement.compile()
+        params = sorted((name, repr(value)) for name, value in compiled.params.items())
+        options = sorted((name, repr(value)) for name, value in query.get_execution_options().items())
+        return hashlib.sha256(f'{compiled}|{params}|{options}'.encode()).hexdigest()
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            if item[1] <= now:
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return item[0]
+
+    def set(self, key: str, total: int, ttl: float = None):
+        with self._lock:
+            self._items[key] = (total, time.time() + (self.ttl if ttl is None else ttl))
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+count_cache = CountCache()
+
+
+class Pagination:
+    """分页结果,字段与flask_sqlalchemy的Pagination一致,可直接传给paginate_info"""
+
+    def __init__(self, items: list, page: int, per_page: int, total: int, is_estimated: bool = False):
+        self.items = items
+        self.page = page
+        self.per_page = per_page
+        self.total = total
+        self.is_estimated = is_estimated
+
+    @property
+    def pages(self) -> int:
+        if not self.per_page or not self.total:
+            return 0
+        return int(math.ceil(self.total / self.per_page))
+
+
+def query_paginate(query, form, total: str = 'exact', cap: int = 10000, ttl: float = None) -> Pagination:
+    """分页查询封装方法,可选择总数的计算方式
+    :param query: 查询对象
+    :param form: 表单,需要page与limit字段(ListPage)
+    :param total: 总数计算方式
+        exact: 每次COUNT,与query.paginate一致
+        cached: 相同查询条件的总数在ttl秒内复用,过期后重新COUNT
+        capped: 最多统计到cap条,超过时is_estimated为True,total为已统计的条数
+    :param cap: capped方式的统计上限
+    :param ttl: cached方式的缓存有效期,默认COUNT_CACHE_TTL
+    :return: Pagination
+    """
+
+    page = form.page.data
+    per_page = form.limit.data
+    items = query.limit(per_page).offset((page - 1) * per_page).all()
+    seen = (page - 1) * per_page + len(items)  # 根据本页数据可以确定的最少条数
+
+    # 第一页数据不满一页时,总数即为本页条数
+    if page == 1 and len(items) < per_page:
+        return Pagination(items, page, per_page, len(items))
+
+    is_estimated = False
+    if total == 'cached':
+        key = count_cache.key(query)
+        count = count_cache.get(key)
+        if count is None:
+            count = query.order_by(None).count()
+            count_cache.set(key, count, ttl=ttl)
+        count = max(count, seen)
+    elif total == 'capped':
+        count = query.order_by(None).limit(cap + 1).count()
+        if count > cap:
+            count = max(cap, seen)
+            is_estimated = True
+    else:
+        count = query.order_by(None).count()
+
+    return Pagination(items, page, per_page, count, is_estimated=is_estimated)
+
+
 def orm_func(func_name: str, *args, **kwargs):
     """orm序列化,funcs参数便捷生成函数"""
     if not len(args):
@@ -39,13 +372,27 @@ def orm_func(func_name: str, *args, **kwargs):
 
 
 def paginate_info(paginate, items):
-    """分页信息"""
+    """分页信息
+    paginate为query_paginate的结果时,增加is_estimated字段表示total是否为估算值
+    """
     result = {
         'total': paginate.total,
         'page': paginate.page,
         'max_page': paginate.pages,
         'items': items
     }
+    if isinstance(paginate, Pagination):
+        result['is_estimated'] = paginate.is_estimated
+    return result
+
+
+def keyset_info(page: KeysetPage, items):
+    """游标分页信息"""
+    result = {
+        'next_cursor': page.next_cursor,
+        'has_more': page.has_more,
+        'items': items
+    }
     return result
 
 
@@ -57,7 +404,41 @@ def result_format(error_code: int = 0, data=None, **kwargs):
         'data': data,
         **kwargs
     }
-    return jsonify(r)
+    return current_app.response_class(json_codec.dumps_bytes(r), mimetype='application/json')
+
+
+def result_stream(items, error_code: int = 0, data: dict = None, serialize=None, chunk_size: int = 500, **kwargs):
+    """流式返回列表数据,响应格式与result_format一致: {error_code, data: {..., items: [...]}, **kwargs}
+    逐块编码并发送items,内存占用与数据总量无关,客户端可以更早收到首个字节.
+    示例: result_stream(query.yield_per(500), data={'has_more': False}, serialize=lambda row: row.serialization())
+    :param items: 数据行的可迭代对象
+    :param data: data中除items外的其他字段
+    :param serialize: 数据行序列化函数,items为模型实例时使用
+    :param chunk_size: 每次发送的行数
+    """
+
+    data_head = json_codec.dumps_bytes(data or dict())[:-1]  # 去掉结尾的'}'
+    head = b'{"error_code":' + json_codec.dumps_bytes(error_code) + b',"data":' + data_head + \
+        (b',"items":[' if len(data_head) > 1 else b'"items":[')
+    tail = b']}' + (b',' + json_codec.dumps_bytes(kwargs)[1:] if kwargs else b'}')
+
+    def generate():
+        yield head
+        buffer = list()
+        first = True
+        for item in items:
+            if serialize is not None:
+                item = serialize(item)
+            buffer.append(json_codec.dumps_bytes(item))
+            if len(buffer) >= chunk_size:
+                yield (b'' if first else b',') + b','.join(buffer)
+                first = False
+                buffer = list()
+        if buffer:
+            yield (b'' if first else b',') + b','.join(buffer)
+        yield tail
+
+    return current_app.response_class(stream_with_context(generate()), mimetype='application/json')
 
 
 def generate_verify_code(length: int = 4) -> str:
@@ -65,7 +446,7 @@ def generate_verify_code(length: int = 4) -> str:
     :param length: 验证码长度
     """
 
-    return ''.join([str(random.randint(0, 9)) for _ in range(length)])
+    return ''.join([str(secrets.randbelow(10)) for _ in range(length)])
 
 
 class NeoDict(dict):
@@ -0,0 +1,177 @@
+"""支付宝与微信支付的asyncio客户端
+与AliPay/WechatPay的方法同名,网关请求改为协程,并限制并发数与单次请求超时.
+示例:
+    async with AsyncAliPay(max_concurrency=20, timeout=10) as client:
+        result = await client.trade_query({'out_trade_no': order_id})
+"""
+import ssl
+import asyncio
+import functools
+import aiohttp
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+from artwork.common import json_codec, metrics
+from artwork.pay import common, wechat_xml
+from artwork.pay.ali import AliPay
+from artwork.pay.wechat import WechatPay
+
+
+class AsyncClientMixin(object):
+    """共享的aiohttp会话,并发数限制与超时"""
+
+    def _init_async(self, max_concurrency: int = 10, timeout: float = 10):
+        """
+        :param max_concurrency: 同时进行的网关请求数上限
+        :param timeout: 单次请求超时时间,秒
+        """
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._semaphore = None
+        self._session = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    async def _request(self, method: str, url: str, timeout: float = None, **kwargs) -> bytes:
+        """发送请求并读取响应内容
+        :param timeout: 本次请求的超时时间,默认使用实例的timeout
+        """
+        if timeout is not None:
+            kwargs['timeout'] = aiohttp.ClientTimeout(total=timeout)
+        async with self.semaphore:
+            async with self.session.request(method, url, **kwargs) as response:
+                response.raise_for_status()
+                return await response.read()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+
+class AsyncAliPay(AsyncClientMixin, AliPay):
+    """支付宝asyncio客户端,返回值为网关响应的json数据"""
+
+    def __init__(self, max_concurrency: int = 10, timeout: float = 10, http_api_url: str = None,
+                 sign_executor=None):
+        """
+        :param http_api_url: 网关地址,测试时可指向本地模拟网关
+        :param sign_executor: 执行RSA签名的Executor,默认为实例独占的单线程池.
+            签名为纯Python计算,多个线程会争抢GIL,需要多核并行或更低的事件循环延迟时传入ProcessPoolExecutor
+        """
+        super().__init__()
+        self._init_async(max_concurrency=max_concurrency, timeout=timeout)
+        if http_api_url:
+            self.http_api_url = http_api_url
+        self._sign_executor = sign_executor
+        self._own_executor = None
+
+    @property
+    def sign_executor(self):
+        if self._sign_executor is None:
+            if self._own_executor is None:
+                self._own_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='alipay-sign')
+            return self._own_executor
+        return self._sign_executor
+
+    async def close(self):
+        await super().close()
+        if self._own_executor is not None:
+            self._own_executor.shutdown(wait=False)
+            self._own_executor = None
+
+    async def _execute(self, method: str, biz_content: dict, timeout: float = None, **kwargs) -> dict:
+        # 签名约20ms,在Executor中执行,不阻塞事件循环
+        loop = asyncio.get_running_loop()
+        params = await loop.run_in_executor(self.sign_executor,
+                                            functools.partial(AliPay.sign_params, method, biz_content, **kwargs))
+        with metrics.gateway.span(method) as span:
+            span.request_bytes = len(urlencode(params))
+            content = await self._request('GET', self.http_api_url, params=params, timeout=timeout)
+            span.response_bytes = len(content)
+            result = json_codec.loads(content)
+            span.code = self.response_code(result) or 'UNKNOWN'
+        return result
+
+    async def trade_refund(self, biz_content: dict, timeout: float = None, **kwargs) -> dict:
+        """退款,参数见AliPay.trade_refund"""
+        return await self._execute('alipay.trade.refund', biz_content, timeout=timeout, **kwargs)
+
+    async def trade_close(self, biz_content: dict, timeout: float = None, **kwargs) -> dict:
+        """关闭交易,参数见AliPay.trade_close"""
+        return await self._execute('alipay.trade.close', biz_content, timeout=timeout, **kwargs)
+
+    async def trade_query(self, biz_content: dict, timeout: float = None, **kwargs) -> dict:
+        """交易查询,参数见AliPay.trade_query"""
+        return await self._execute('alipay.trade.query', biz_content, timeout=timeout, **kwargs)
+
+
+class AsyncWechatPay(AsyncClientMixin, WechatPay):
+    """微信支付asyncio客户端,返回值为网关响应xml解析后的字典表"""
+
+    def __init__(self, max_concurrency: int = 10, timeout: float = 10, api_url: str = None, refund_url: str = None,
+                 order_query_url: str = None):
+        """
+        :param api_url: 统一下单地址,测试时可指向本地模拟网关
+        :param refund_url: 申请退款地址
+        :param order_query_url: 查询订单地址
+        """
+        super().__init__()
+        self._init_async(max_concurrency=max_concurrency, timeout=timeout)
+        if api_url:
+            self.api_url = api_url
+        if refund_url:
+            self.refund_url = refund_url
+        if order_query_url:
+            self.order_query_url = order_query_url
+        self._ssl_context = None
+
+    @property
+    def ssl_context(self) -> ssl.SSLContext:
+        """商户证书只加载一次"""
+        if self._ssl_context is None:
+            context = ssl.create_default_context()
+            context.load_cert_chain(self.cert_path, self.cert_key_path)
+            self._ssl_context = context
+        return self._ssl_context
+
+    async def _gateway_request(self, operation: str, url: str, data: bytes, timeout: float = None, **kwargs) -> dict:
+        """请求网关并记录耗时,返回码与请求/响应大小"""
+        with metrics.gateway.span(operation) as span:
+            content = await self._request('POST', url, data=data, timeout=timeout, **kwargs)
+            span.request_bytes = len(data)
+            span.response_bytes = len(content)
+            result = wechat_xml.loads(content)
+            span.code = self.response_code(result)
+        return result
+
+    async def feedback_func(self, params: dict, timeout: float = None) -> dict:
+        """统一下单,发送返回支付参数"""
+        data = wechat_xml.dumps(params)
+        return await self._gateway_request('wechat.unifiedorder', self.api_url, data, timeout=timeout)
+
+    async def order_query(self, out_trade_no: str, timeout: float = None) -> dict:
+        """查询订单,参数见WechatPay.order_query"""
+        xml_data = common.trans_dict_to_xml(self.order_query_data(out_trade_no))
+        return await self._gateway_request('wechat.orderquery', self.order_query_url, xml_data, timeout=timeout)
+
+    async def apply_refund(self, params: dict, timeout: float = None) -> dict:
+        """申请退款,参数见WechatPay.apply_refund"""
+        xml_data = common.trans_dict_to_xml(self.refund_data(params))
+        ssl_context = self.ssl_context if self.refund_url.startswith('https') else None
+        return await self._gateway_request('wechat.refund', self.refund_url, xml_data, timeout=timeout, ssl=ssl_context)
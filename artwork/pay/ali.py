@@ -1,14 +1,14 @@
 import logging
 import uuid
 import datetime
-import json
 import requests
 from alipay.aop.api.AlipayClientConfig import AlipayClientConfig
 from alipay.aop.api.DefaultAlipayClient import DefaultAlipayClient
 from alipay.aop.api.domain.AlipayTradeAppPayModel import AlipayTradeAppPayModel
 from alipay.aop.api.request.AlipayTradeAppPayRequest import AlipayTradeAppPayRequest
-from alipay.aop.api.util.SignatureUtils import sign_with_rsa2
+from artwork.common import json_codec, metrics
 from artwork.pay import common
+from artwork.pay.signer import RSA2Signer
 
 logging.basicConfig(
     level=logging.INFO,
@@ -16,13 +16,42 @@ logging.basicConfig(
     filemode='a', )
 logger = logging.getLogger('')
 
+signer = RSA2Signer(private_key="""config.alipay_private_key""", public_key="""config.alipay_public_key""")
+
 
 class AliPay:
     callback_url = 'https://test_app.xunbaowang.net/interface/v1/transaction/pay/ali/app/pay_callback/'
     http_api_url = 'https://openapi.alipay.com/gateway.do'
 
-    def __init__(self):
+    def __init__(self, pool_size: int = 10, retries: int = 3, backoff_factor: float = 0.3):
+        """
+        :param pool_size: 网关连接池大小
+        :param retries: 查询等幂等请求的重试次数
+        :param backoff_factor: 重试间隔系数
+        """
         self.client = self._init()
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self._http = None
+        self._http_no_retry = None
+
+    @property
+    def http(self) -> requests.Session:
+        """实例持有的长连接会话"""
+        if self._http is None:
+            self._http = common.create_session(pool_size=self.pool_size, retries=self.retries,
+                                               backoff_factor=self.backoff_factor)
+        return self._http
+
+    @property
+    def http_no_retry(self) -> requests.Session:
+        """不自动重试的长连接会话,用于退款/关闭交易等非幂等操作
+        支付宝网关的请求都是GET,适配器按HTTP方法判断会重试这些操作,需要按操作区分
+        """
+        if self._http_no_retry is None:
+            self._http_no_retry = common.create_session(pool_size=self.pool_size, retries=0)
+        return self._http_no_retry
 
     def _init(self):
         alipay_client_config = AlipayClientConfig()
@@ -57,7 +86,60 @@ class AliPay:
 
         request = AlipayTradeAppPayRequest(biz_model=model)
         request.notify_url = callback_url
-        return self.client.sdk_execute(request)
+        with metrics.gateway.span('alipay.pay_apply') as span:
+            result = self.client.sdk_execute(request)
+            span.response_bytes = len(result)
+        return result
+
+    @staticmethod
+    def sign_params(method: str, biz_content: dict, charset: str = 'utf-8', sign_type='RSA2', version='1.0') -> dict:
+        """生成带签名的公共请求参数
+        :param method: 接口名称,示例:alipay.trade.query
+        :param biz_content: 请求参数的集合
+        :return: 请求参数字典表
+        """
+        params = {
+            'app_id': """config.app_id""", 'method': method, 'charset': charset, 'sign_type': sign_type,
+            'timestamp': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'version': version,
+            'biz_content': json_codec.dumps(biz_content)
+        }
+        params.update({'sign': signer.sign(params, charset=charset)})
+        return params
+
+    @staticmethod
+    def response_code(data: dict) -> str:
+        """网关响应的返回码,有业务错误码sub_code时返回sub_code
+        :param data: 网关响应的json数据
+        """
+        for key, value in data.items():
+            if key.endswith('_response') and isinstance(value, dict):
+                return value.get('sub_code') or value.get('code') or ''
+        return ''
+
+    def _gateway_get(self, method: str, params: dict, retry: bool = True) -> requests.Response:
+        """请求网关并记录耗时,返回码与请求/响应大小
+        :param retry: 失败时是否自动重试,非幂等操作需要传入False
+        """
+        http = self.http if retry else self.http_no_retry
+        with metrics.gateway.span(method) as span:
+            response = http.get(url=self.http_api_url, params=params)
+            span.request_bytes = len(response.request.url)
+            span.response_bytes = len(response.content)
+            if response.status_code != 200:
+                span.code = f'HTTP_{response.status_code}'
+            else:
+                try:
+                    span.code = self.response_code(json_codec.loads(response.content)) or 'UNKNOWN'
+                except ValueError:
+                    span.code = 'INVALID_RESPONSE'
+        return response
+
+    @staticmethod
+    def verify_notify(params: dict) -> bool:
+        """验证支付宝异步通知签名
+        :param params: 通知参数字典表
+        """
+        return signer.verify(params)
 
     def trade_refund(self, biz_content: dict, charset: str = 'utf-8', sign_type='RSA2', version='1.0'):
         """退款
@@ -68,16 +150,8 @@ class AliPay:
         :return:
         """
 
-        params = {
-            'app_id': """config.app_id""", 'method': 'alipay.trade.refund', 'charset': charset, 'sign_type': sign_type,
-            'timestamp': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'version': version,
-            'biz_content': json.dumps(biz_content)
-        }
-        sign = sign_with_rsa2("""config.alipay_private_key""",
-                              sign_content=common.generate_sign_text(params, sign_type=True), charset=charset)
-        params.update({'sign': sign})
-
-        return requests.get(url=self.http_api_url, params=params)
+        params = self.sign_params('alipay.trade.refund', biz_content, charset=charset, sign_type=sign_type, version=version)
+        return self._gateway_get('alipay.trade.refund', params, retry=False)
 
     def trade_close(self, biz_content: dict, charset: str = 'utf-8', sign_type='RSA2', version='1.0'):
         """关闭交易
@@ -86,16 +160,8 @@ class AliPay:
         :param sign_type: 签名加密算法
         :return:
         """
-        params = {
-            'app_id': """config.app_id""", 'method': 'alipay.trade.close', 'charset': charset, 'sign_type': sign_type,
-            'timestamp': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'version': version,
-            'biz_content': json.dumps(biz_content)
-        }
-        sign = sign_with_rsa2("""config.alipay_private_key""",
-                              sign_content=common.generate_sign_text(params, sign_type=True), charset=charset)
-        params.update({'sign': sign})
-
-        return requests.get(url=self.http_api_url, params=params)
+        params = self.sign_params('alipay.trade.close', biz_content, charset=charset, sign_type=sign_type, version=version)
+        return self._gateway_get('alipay.trade.close', params, retry=False)
 
     def trade_query(self, biz_content: dict, charset: str = 'utf-8', sign_type='RSA2', version='1.0'):
         """交易查询
@@ -104,16 +170,8 @@ class AliPay:
         :param sign_type: 签名加密算法
         :return:
         """
-        params = {
-            'app_id': """config.app_id""", 'method': 'alipay.trade.query', 'charset': charset, 'sign_type': sign_type,
-            'timestamp': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'version': version,
-            'biz_content': json.dumps(biz_content)
-        }
-        sign = sign_with_rsa2("""config.alipay_private_key""",
-                              sign_content=common.generate_sign_text(params, sign_type=True), charset=charset)
-        params.update({'sign': sign})
-
-        return requests.get(url=self.http_api_url, params=params)
+        params = self.sign_params('alipay.trade.query', biz_content, charset=charset, sign_type=sign_type, version=version)
+        return self._gateway_get('alipay.trade.query', params)
 
     def test_func(self):
         """测试函数"""
@@ -5,17 +5,16 @@ import urllib
 import urllib.parse
 import random
 import string
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.util.ssl_ import create_urllib3_context
+from artwork.pay import wechat_xml
 
 
 def trans_dict_to_xml(data_dict):
-    """字典转XML"""
-    data_xml = []
-    for k in sorted(data_dict.keys()):  # 遍历字典排序后的key
-        v = data_dict.get(k)  # 取出字典中key对应的value
-        if k == 'detail' and not v.startswith('<![CDATA['):  # 添加XML标记
-            v = '<![CDATA[{}]]>'.format(v)
-        data_xml.append('<{key}>{value}</{key}>'.format(key=k, value=v))
-    return '<xml>{}</xml>'.format(''.join(data_xml)).encode('utf-8')  # 返回XML，并转成utf-8，解决中文的问题
+    """字典转XML,返回utf-8编码的xml,见wechat_xml.dumps"""
+    return wechat_xml.dumps(data_dict)
 
 
 def generate_sign_text(params: dict, sign: bool = False, sign_type: bool = False):
@@ -48,3 +47,46 @@ def get_random_str():
     # 从指定序列中随机获取指定长度的片断, ascii_letters是生成所有字母，从a-z和A-Z, digits是生成所有数字0-9
     random_str = ''.join(random.sample(string.ascii_letters + string.digits, 32))
     return random_str
+
+
+class CertAdapter(HTTPAdapter):
+    """携带商户证书的连接池适配器
+    证书只在创建时加载一次到SSLContext,连接池内的连接复用TLS会话,免去每次请求重新加载证书与双向握手
+    """
+
+    def __init__(self, cert_path: str, cert_key_path: str, **kwargs):
+        self.ssl_context = create_urllib3_context()
+        self.ssl_context.load_default_certs()
+        self.ssl_context.load_cert_chain(cert_path, cert_key_path)
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['ssl_context'] = self.ssl_context
+        return super().init_poolmanager(*args, **kwargs)
+
+    def proxy_manager_for(self, *args, **kwargs):
+        kwargs['ssl_context'] = self.ssl_context
+        return super().proxy_manager_for(*args, **kwargs)
+
+
+def create_adapter(pool_size: int = 10, retries: int = 3, backoff_factor: float = 0.3, adapter_class=HTTPAdapter,
+                   **kwargs) -> HTTPAdapter:
+    """创建连接池适配器
+    只对幂等请求(GET等)重试,POST请求不重试,避免重复下单/退款.
+    通过GET发起的非幂等操作(例如支付宝退款)需要使用retries=0的会话
+    :param pool_size: 每个域名保持的连接数
+    :param retries: 重试次数
+    :param backoff_factor: 重试间隔系数,第n次重试等待 backoff_factor * 2^(n-1) 秒
+    """
+    retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=(500, 502, 503, 504),
+                  raise_on_status=False)
+    return adapter_class(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry, **kwargs)
+
+
+def create_session(pool_size: int = 10, retries: int = 3, backoff_factor: float = 0.3) -> requests.Session:
+    """创建保持长连接的请求会话,参数见create_adapter"""
+    session = requests.Session()
+    adapter = create_adapter(pool_size=pool_size, retries=retries, backoff_factor=backoff_factor)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
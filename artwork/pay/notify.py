@@ -0,0 +1,195 @@
+"""支付异步通知处理
+解析 -> 验签 -> 按交易号去重 -> 调用业务处理函数 -> 返回网关需要的应答.
+网关会多次重试同一通知,已处理过的通知直接应答成功,不再调用业务处理函数(不访问数据库).
+视图中使用:
+    processor = wechat_processor(handler=update_order)
+    result = processor.process(request.get_data())
+    return result.response
+"""
+import time
+import threading
+from collections import OrderedDict
+from urllib.parse import parse_qsl
+from artwork.pay import wechat_xml
+
+IDEMPOTENCY_CACHE_SIZE = 100000  # 已处理通知缓存数量上限
+IDEMPOTENCY_CACHE_TTL = 3600 * 24  # 已处理通知缓存有效期,秒,覆盖网关的重试周期
+IDEMPOTENCY_PROCESSING_TTL = 60  # 处理中标记有效期,秒,进程异常退出未释放时到期后允许重试
+
+WECHAT_SUCCESS = wechat_xml.dumps({'return_code': 'SUCCESS', 'return_msg': 'OK'})
+WECHAT_FAIL = wechat_xml.dumps({'return_code': 'FAIL', 'return_msg': 'FAIL'})
+ALIPAY_SUCCESS = b'success'
+ALIPAY_FAIL = b'failure'
+
+
+class IdempotencyCache:
+    """已处理通知的去重缓存(LRU+TTL)
+    processing: 正在处理中,重复通知返回失败,由网关稍后重试
+    done: 已处理完成,重复通知直接应答成功
+    """
+
+    PROCESSING = 1
+    DONE = 2
+
+    def __init__(self, maxsize: int = IDEMPOTENCY_CACHE_SIZE, ttl: float = IDEMPOTENCY_CACHE_TTL,
+                 processing_ttl: float = IDEMPOTENCY_PROCESSING_TTL):
+        """
+        :param maxsize: 缓存数量上限
+        :param ttl: 已处理(DONE)标记有效期,秒
+        :param processing_ttl: 处理中(PROCESSING)标记有效期,秒
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.processing_ttl = processing_ttl
+        self._items = OrderedDict()  # {key: (state, expire_at)}
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str):
+        """标记为处理中
+        :return: None表示获取成功,否则返回已有状态(PROCESSING/DONE)
+        """
+        now = time.time()
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and item[1] > now:
+                return item[0]
+            self._set(key, self.PROCESSING, now + self.processing_ttl)
+            return None
+
+    def done(self, key: str):
+        """标记为已处理"""
+        with self._lock:
+            self._set(key, self.DONE, time.time() + self.ttl)
+
+    def release(self, key: str):
+        """处理失败,移除标记以便重试"""
+        with self._lock:
+            self._items.pop(key, None)
+
+    def _set(self, key: str, state: int, expire_at: float):
+        self._items.pop(key, None)
+        self._items[key] = (state, expire_at)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+
+class NotifyResult:
+    """通知处理结果"""
+
+    def __init__(self, ok: bool, response: bytes, data: dict = None, duplicate: bool = False, error=None):
+        """
+        :param ok: 是否处理成功
+        :param response: 返回给网关的应答内容
+        :param data: 解析后的通知数据
+        :param duplicate: 是否为已处理过的重复通知
+        :param error: 失败原因
+        """
+        self.ok = ok
+        self.response = response
+        self.data = data
+        self.duplicate = duplicate
+        self.error = error
+
+
+class NotificationProcessor:
+    """通知处理器,可在视图或队列任务中调用"""
+
+    def __init__(self, parse, verify, key_func, handler, success: bytes, fail: bytes, cache: IdempotencyCache = None):
+        """
+        :param parse: 原始请求体 -> 通知数据字典表
+        :param verify: 通知数据 -> 签名是否正确
+        :param key_func: 通知数据 -> 去重键,返回None时不去重
+        :param handler: 业务处理函数,参数为通知数据,抛出异常视为处理失败
+        :param success: 处理成功时的应答
+        :param fail: 处理失败时的应答
+        :param cache: 去重缓存,默认每个处理器独立一个
+        """
+        self.parse = parse
+        self.verify = verify
+        self.key_func = key_func
+        self.handler = handler
+        self.success = success
+        self.fail = fail
+        self.cache = cache if cache is not None else IdempotencyCache()
+
+    def process(self, body) -> NotifyResult:
+        """处理一次通知
+        :param body: 原始请求体
+        """
+
+        try:
+            data = self.parse(body)
+        except Exception as err:
+            return NotifyResult(False, self.fail, error=err)
+
+        try:
+            verified = self.verify(data)
+        except Exception as err:
+            return NotifyResult(False, self.fail, data=data, error=err)
+        if not verified:
+            return NotifyResult(False, self.fail, data=data, error='signature failure')
+
+        key = self.key_func(data)
+        if key is not None:
+            state = self.cache.acquire(key)
+            if state == IdempotencyCache.DONE:
+                return NotifyResult(True, self.success, data=data, duplicate=True)
+            if state == IdempotencyCache.PROCESSING:
+                return NotifyResult(False, self.fail, data=data, duplicate=True, error='processing')
+
+        try:
+            self.handler(data)
+        except Exception as err:
+            if key is not None:
+                self.cache.release(key)
+            return NotifyResult(False, self.fail, data=data, error=err)
+
+        if key is not None:
+            self.cache.done(key)
+        return NotifyResult(True, self.success, data=data)
+
+
+def wechat_key(data: dict):
+    """微信支付结果通知去重键: 微信支付订单号"""
+    if data.get('return_code') != 'SUCCESS':
+        return None
+    return data.get('transaction_id')
+
+
+def alipay_key(data: dict):
+    """支付宝异步通知去重键: 支付宝交易号+交易状态,同一交易的不同状态分别处理"""
+    trade_no = data.get('trade_no')
+    if not trade_no:
+        return None
+    return f"{trade_no}:{data.get('trade_status')}"
+
+
+def parse_alipay(body) -> dict:
+    """解析支付宝异步通知(application/x-www-form-urlencoded)"""
+    if isinstance(body, bytes):
+        body = body.decode('utf-8')
+    if isinstance(body, str):
+        return dict(parse_qsl(body, keep_blank_values=True))
+    return dict(body)
+
+
+def wechat_processor(handler, signer=None, cache: IdempotencyCache = None) -> NotificationProcessor:
+    """微信支付结果通知处理器
+    :param handler: 业务处理函数
+    :param signer: wechat.WechatSigner,默认使用wechat.signer
+    """
+    if signer is None:
+        from artwork.pay.wechat import signer
+    return NotificationProcessor(parse=wechat_xml.loads, verify=signer.verify, key_func=wechat_key,
+                                 handler=handler, success=WECHAT_SUCCESS, fail=WECHAT_FAIL, cache=cache)
+
+
+def alipay_processor(handler, signer=None, cache: IdempotencyCache = None) -> NotificationProcessor:
+    """支付宝异步通知处理器
+    :param handler: 业务处理函数
+    :param signer: signer.RSA2Signer,默认使用ali.signer
+    """
+    if signer is None:
+        from artwork.pay.ali import signer
+    return NotificationProcessor(parse=parse_alipay, verify=signer.verify, key_func=alipay_key,
+                                 handler=handler, success=ALIPAY_SUCCESS, fail=ALIPAY_FAIL, cache=cache)
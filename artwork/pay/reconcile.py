@@ -0,0 +1,186 @@
+"""订单批量对账
+并发查询网关订单状态,按完成顺序流式返回结果,并记录进度,中断后可从断点继续.
+示例:
+    async with AsyncAliPay() as client:
+        reconciler = Reconciler.for_alipay(client, concurrency=20, rate=50, checkpoint_path='reconcile.json')
+        async for out_trade_no, status, result in reconciler.iter(trade_nos):
+            ...
+        print(reconciler.counts)
+"""
+import os
+import json
+import asyncio
+import itertools
+from collections import Counter
+
+ERROR_STATUS = 'ERROR'  # 查询失败(网络错误,超时等)时的状态
+
+
+class RateLimiter:
+    """限制每秒发起的请求数"""
+
+    def __init__(self, rate: float):
+        """
+        :param rate: 每秒请求数,0为不限制
+        """
+        self.interval = 1 / rate if rate else 0
+        self._next = 0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            now = loop.time()
+            if self._next > now:
+                await asyncio.sleep(self._next - now)
+                now = self._next
+            self._next = now + self.interval
+
+
+class Checkpoint:
+    """对账进度
+    只记录已连续完成的订单数量(offset),重启后跳过前offset个订单;断点之后已完成的少量订单会被重新查询.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+
+    def load(self) -> int:
+        if not self.path or not os.path.exists(self.path):
+            return 0
+        with open(self.path) as f:
+            return json.load(f).get('offset', 0)
+
+    def save(self, offset: int):
+        if not self.path:
+            return
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({'offset': offset}, f)
+        os.replace(temp_path, self.path)  # 原子替换,避免写入中断导致进度文件损坏
+
+    def clear(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def alipay_status(result: dict) -> str:
+    """支付宝交易查询结果的交易状态"""
+    response = result.get('alipay_trade_query_response', dict())
+    return response.get('trade_status') or response.get('sub_code') or response.get('code')
+
+
+def wechat_status(result: dict) -> str:
+    """微信订单查询结果的交易状态"""
+    return result.get('trade_state') or result.get('err_code') or result.get('return_code')
+
+
+class Reconciler:
+    """批量对账执行器"""
+
+    def __init__(self, query, status_func, concurrency: int = 20, rate: float = 0,
+                 checkpoint_path: str = None, checkpoint_every: int = 100):
+        """
+        :param query: 协程函数,参数为out_trade_no,返回网关查询结果
+        :param status_func: 从查询结果中取出交易状态的函数
+        :param concurrency: 同时进行的查询数上限
+        :param rate: 每秒查询数上限,0为不限制
+        :param checkpoint_path: 进度文件路径,None为不记录进度
+        :param checkpoint_every: 每完成多少个订单保存一次进度
+        """
+        self.query = query
+        self.status_func = status_func
+        self.concurrency = concurrency
+        self.limiter = RateLimiter(rate)
+        self.checkpoint = Checkpoint(checkpoint_path)
+        self.checkpoint_every = checkpoint_every
+        self.counts = Counter()  # {交易状态: 数量}
+
+    @classmethod
+    def for_alipay(cls, client, **kwargs):
+        """支付宝对账
+        :param client: AsyncAliPay
+        """
+
+        async def query(out_trade_no):
+            return await client.trade_query({'out_trade_no': out_trade_no})
+
+        return cls(query, alipay_status, **kwargs)
+
+    @classmethod
+    def for_wechat(cls, client, **kwargs):
+        """微信支付对账
+        :param client: AsyncWechatPay
+        """
+        return cls(client.order_query, wechat_status, **kwargs)
+
+    async def _query(self, index: int, out_trade_no: str):
+        await self.limiter.wait()
+        try:
+            result = await self.query(out_trade_no)
+        except Exception as err:
+            return index, out_trade_no, ERROR_STATUS, err
+        return index, out_trade_no, self.status_func(result), result
+
+    async def iter(self, trade_nos):
+        """并发查询,按完成顺序逐个返回 (out_trade_no, status, result)
+        查询失败时status为ERROR,result为异常对象.同时进行中的查询不超过concurrency个,内存占用与订单总数无关.
+        :param trade_nos: out_trade_no 可迭代对象,重启时需要保持相同顺序
+        全部完成后删除进度文件;中断时保存进度,下一次调用从断点继续
+        """
+
+        offset = self.checkpoint.load()
+        trade_nos = itertools.islice(enumerate(trade_nos), offset, None)  # 跳过已完成的订单
+        watermark = offset  # 此前的订单均已完成
+        done = set()  # watermark之后已完成的订单序号
+        pending = set()
+        finished = 0
+        complete = False
+
+        try:
+            while True:
+                for index, out_trade_no in trade_nos:
+                    pending.add(asyncio.ensure_future(self._query(index, out_trade_no)))
+                    if len(pending) >= self.concurrency:
+                        break
+                if not pending:
+                    complete = True
+                    break
+
+                completed, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in completed:
+                    index, out_trade_no, status, result = task.result()
+                    self.counts[status] += 1
+                    done.add(index)
+                    yield out_trade_no, status, result
+
+                while watermark in done:
+                    done.remove(watermark)
+                    watermark += 1
+                finished += len(completed)
+                if finished >= self.checkpoint_every:
+                    finished = 0
+                    self.checkpoint.save(watermark)
+        finally:
+            for task in pending:  # 提前结束迭代时取消进行中的查询
+                task.cancel()
+            if complete:
+                self.checkpoint.clear()  # 全部完成后删除进度,下一次对账从头开始
+            else:
+                self.checkpoint.save(watermark)
+
+    async def run(self, trade_nos, callback=None) -> Counter:
+        """执行对账
+        :param trade_nos: out_trade_no 可迭代对象
+        :param callback: 每个订单完成后调用,参数为(out_trade_no, status, result),可以是协程函数
+        :return: 各交易状态的数量
+        """
+
+        async for out_trade_no, status, result in self.iter(trade_nos):
+            if callback is not None:
+                ret = callback(out_trade_no, status, result)
+                if asyncio.iscoroutine(ret):
+                    await ret
+        return self.counts
@@ -0,0 +1,105 @@
+"""支付宝RSA2签名与验签
+密钥在进程内只解析一次,避免每次请求重复解析PEM.
+"""
+import base64
+import functools
+from concurrent.futures import ProcessPoolExecutor
+import rsa
+from alipay.aop.api.util.SignatureUtils import fill_private_key_marker, fill_public_key_marker
+from artwork.pay import common
+
+
+@functools.lru_cache(maxsize=8)
+def load_private_key(private_key: str) -> rsa.PrivateKey:
+    """解析应用私钥,同一密钥只解析一次"""
+    return rsa.PrivateKey.load_pkcs1(fill_private_key_marker(private_key), format='PEM')
+
+
+@functools.lru_cache(maxsize=8)
+def load_public_key(public_key: str) -> rsa.PublicKey:
+    """解析支付宝公钥,同一密钥只解析一次"""
+    return rsa.PublicKey.load_pkcs1_openssl_pem(fill_public_key_marker(public_key))
+
+
+class RSA2Signer:
+    """RSA2(SHA256WithRSA)签名器
+    示例:
+        signer = RSA2Signer(private_key, public_key)
+        params['sign'] = signer.sign(params)
+        signer.verify(notify_params)
+    """
+
+    def __init__(self, private_key: str = None, public_key: str = None, charset: str = 'utf-8'):
+        """
+        :param private_key: 应用私钥,用于签名
+        :param public_key: 支付宝公钥,用于验签
+        :param charset: 签名文本编码
+        """
+        self.private_key = private_key
+        self.public_key = public_key
+        self.charset = charset
+
+    def sign_text(self, text: str, charset: str = None) -> str:
+        """对签名文本签名"""
+        charset = charset or self.charset
+        signature = rsa.sign(text.encode(charset), load_private_key(self.private_key), 'SHA-256')
+        return base64.b64encode(signature).decode(charset)
+
+    def sign(self, params: dict, sign_type: bool = True, charset: str = None) -> str:
+        """对请求参数签名
+        :param params: 请求参数字典表,不会被修改
+        :param sign_type: 签名文本是否包含sign_type字段,请求网关时需要包含
+        """
+        return self.sign_text(common.generate_sign_text(dict(params), sign_type=sign_type), charset=charset)
+
+    @staticmethod
+    def verify_text(params: dict) -> str:
+        """验签文本: 去除sign与sign_type后按key排序拼接
+        通知参数已经URL解码,与SDK的SignatureUtils.get_sign_content一致不再unquote,
+        否则passback_params等URL编码的业务参数会被二次解码导致验签失败
+        """
+        return '&'.join(f'{k}={v}' for k, v in sorted(params.items()) if k not in ('sign', 'sign_type'))
+
+    def verify(self, params: dict, sign: str = None, charset: str = None) -> bool:
+        """验证支付宝异步通知签名,签名文本不包含sign与sign_type字段
+        :param params: 通知参数字典表,不会被修改
+        :param sign: 签名,默认取params['sign']
+        """
+        charset = charset or self.charset
+        if sign is None:
+            sign = params.get('sign')
+        if not sign:
+            return False
+        text = self.verify_text(params)
+        try:
+            rsa.verify(text.encode(charset), base64.b64decode(sign), load_public_key(self.public_key))
+        except (rsa.VerificationError, ValueError):
+            return False
+        return True
+
+    def sign_many(self, params_list: list, processes: int = None, chunksize: int = 100,
+                  sign_type: bool = True) -> list:
+        """批量签名,分发到进程池执行,适用于批量任务
+        :param params_list: 请求参数字典表列表
+        :param processes: 进程数,默认为CPU核数
+        :param chunksize: 每个进程单次处理的数量
+        :return: 与params_list顺序一致的签名列表
+        """
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                                 initargs=(self.private_key, self.charset)) as executor:
+            return list(executor.map(functools.partial(_sign_worker, sign_type=sign_type), params_list,
+                                     chunksize=chunksize))
+
+
+_worker_signer = None
+
+
+def _init_worker(private_key: str, charset: str):
+    """进程池初始化,每个进程只解析一次私钥"""
+    global _worker_signer
+    _worker_signer = RSA2Signer(private_key=private_key, charset=charset)
+    load_private_key(private_key)
+
+
+def _sign_worker(params: dict, sign_type: bool = True) -> str:
+    return _worker_signer.sign(params, sign_type=sign_type)
@@ -1,9 +1,52 @@
+import hmac
 import requests
 import uuid
 import hashlib
-import xmltodict
 from flask import request
-from artwork.pay import common
+from artwork.common import metrics
+from artwork.pay import common, wechat_xml
+
+
+class WechatSigner(object):
+    """微信支付签名(MD5/HMAC-SHA256)
+    按微信签名规则,sign字段与空值不参与签名
+    """
+
+    def __init__(self, api_key: str):
+        """
+        :param api_key: 商户平台设置的API密钥
+        """
+        self.api_key = api_key
+        self._key_suffix = f'&key={api_key}'
+        self._hmac_key = api_key.encode()
+
+    @staticmethod
+    def message(params: dict) -> str:
+        """签名文本(不含key)"""
+        return '&'.join(f'{k}={v}' for k, v in sorted(params.items()) if k != 'sign' and v is not None and v != '')
+
+    def sign(self, params: dict, sign_type: str = 'MD5') -> str:
+        """生成签名
+        :param sign_type: MD5 或 HMAC-SHA256
+        """
+        message = (self.message(params) + self._key_suffix).encode()
+        if sign_type == 'HMAC-SHA256':
+            return hmac.new(self._hmac_key, message, hashlib.sha256).hexdigest().upper()
+        return hashlib.md5(message).hexdigest().upper()
+
+    def verify(self, params: dict, sign_type: str = None) -> bool:
+        """验证签名,使用常量时间比较
+        :param sign_type: 默认取params['sign_type'],没有时为MD5
+        """
+        sign = params.get('sign')
+        if not sign or not isinstance(sign, str):
+            return False
+        sign_type = sign_type or params.get('sign_type') or 'MD5'
+        expected = self.sign(params, sign_type=sign_type)
+        return hmac.compare_digest(expected.encode('utf-8'), sign.upper().encode('utf-8'))
+
+
+signer = WechatSigner("""config.api_key""")
 
 
 class WechatPay(object):
@@ -11,27 +54,50 @@ class WechatPay(object):
     api_url = 'https://api.mch.weixin.qq.com/pay/unifiedorder'
     refund_url = 'https://api.mch.weixin.qq.com/secapi/pay/refund'
     check_refund_url = 'https://api.mch.weixin.qq.com/pay/refundquery'
+    order_query_url = 'https://api.mch.weixin.qq.com/pay/orderquery'
     notify_url = 'https://test_app.xunbaowang.net/interface/v1/transaction/pay/wechat/app/pay_callback/'
 
-    def __init__(self):
+    def __init__(self, pool_size: int = 10, retries: int = 3, backoff_factor: float = 0.3):
         """
         :param app_id:应用编号
         :param merchant_id:商户编号
+        :param pool_size: 网关连接池大小
+        :param retries: 幂等请求的重试次数,下单与退款为POST请求不会重试
+        :param backoff_factor: 重试间隔系数
         """
         self.app_id = """config.app_id"""
         self.merchant_id = """config.merchant_app_id"""
         self.cert_path = 'plugins/public/wechat_pay/wechat_pay_cert/apiclient_cert.pem'  # 证书
         self.cert_key_path = 'plugins/public/wechat_pay/wechat_pay_cert/apiclient_key.pem'  # key
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self._http = None
+        self._cert_http = None
+
+    @property
+    def http(self) -> requests.Session:
+        """实例持有的长连接会话"""
+        if self._http is None:
+            self._http = common.create_session(pool_size=self.pool_size, retries=self.retries,
+                                               backoff_factor=self.backoff_factor)
+        return self._http
+
+    @property
+    def cert_http(self) -> requests.Session:
+        """携带商户证书的长连接会话,证书只加载一次"""
+        if self._cert_http is None:
+            session = requests.Session()
+            session.mount('https://', common.create_adapter(
+                pool_size=self.pool_size, retries=self.retries, backoff_factor=self.backoff_factor,
+                adapter_class=common.CertAdapter, cert_path=self.cert_path, cert_key_path=self.cert_key_path))
+            self._cert_http = session
+        return self._cert_http
 
     @staticmethod
     def generate_sign(params: dict):
         """生成请求签名"""
-        params = sorted(params.items(), key=lambda x: x[0], reverse=False)
-        message = "&".join(f"{k}={v}" for k, v in params if k not in ['sign'])
-        message = f'{message}&key={"""config.api_key"""}'
-        md5 = hashlib.md5()
-        md5.update(message.encode())
-        return md5.hexdigest().upper()
+        return signer.sign(params)
 
     def base_params(self):
         """基础参数"""
@@ -50,26 +116,64 @@ class WechatPay(object):
 
         return model
 
+    @staticmethod
+    def response_code(data: dict) -> str:
+        """网关响应的返回码,通信失败为return_code,业务失败为err_code"""
+        if data.get('return_code') != 'SUCCESS':
+            return data.get('return_code') or 'UNKNOWN'
+        if data.get('result_code') not in (None, 'SUCCESS'):
+            return data.get('err_code') or data['result_code']
+        return 'SUCCESS'
+
+    def _gateway_post(self, operation: str, http: requests.Session, url: str, data, strict: bool = True) -> tuple:
+        """请求网关并记录耗时,返回码与请求/响应大小
+        :param strict: 响应不是合法xml时是否抛出XMLDecodeError,否则解析结果为None
+        :return: (响应, 响应xml解析后的字典表)
+        """
+        with metrics.gateway.span(operation) as span:
+            response = http.post(url=url, data=data)
+            content = response.content
+            span.request_bytes = len(data.encode() if isinstance(data, str) else data)
+            span.response_bytes = len(content)
+            try:
+                result = wechat_xml.loads(content)
+            except wechat_xml.XMLDecodeError:
+                span.code = f'HTTP_{response.status_code}'
+                if strict:
+                    raise
+                return response, None
+            span.code = self.response_code(result)
+        return response, result
+
     def feedback_func(self, params: dict):
         """发送返回支付参数"""
-        params = {'xml': params}
-        data = xmltodict.unparse(params, pretty=True)
-        result = requests.post(url=self.api_url, data=data.encode()).content
-        return dict(xmltodict.parse(result)['xml'])
+        data = wechat_xml.dumps(params)
+        return self._gateway_post('wechat.unifiedorder', self.http, self.api_url, data)[1]
 
-    def apply_refund(self, params: dict):
-        """
-        申请退款
-        params字段如下:
-         total_fee: 订单总金额，单位为分
-         refund_fee: 退款总金额，单位为分
-         out_refund_no: 商户系统内部的退款单号，商户系统内部唯一，同一退款单号多次请求只退一笔
-         transaction_id: 可选，微信订单号
-         out_trade_no: 商户系统内部的订单号，与 transaction_id 二选一
-         nonce_str: 随机字符串
-        :return: 返回的结果数据
+    def order_query_data(self, out_trade_no: str) -> dict:
+        """查询订单的请求数据(已签名)"""
+
+        data = {
+            'appid': self.app_id,
+            'mch_id': self.merchant_id,
+            'out_trade_no': out_trade_no,
+            'nonce_str': uuid.uuid1().hex
+        }
+        data.update({'sign': self.generate_sign(data)})
+        return data
+
+    def order_query(self, out_trade_no: str) -> dict:
+        """查询订单
+        :param out_trade_no: 商户订单号
+        :return: 返回的结果数据,交易状态为trade_state字段
         """
 
+        xml_data = common.trans_dict_to_xml(self.order_query_data(out_trade_no))
+        return self._gateway_post('wechat.orderquery', self.http, self.order_query_url, xml_data)[1]
+
+    def refund_data(self, params: dict) -> dict:
+        """申请退款的请求数据(已签名),字段说明见apply_refund"""
+
         data = {
             'appid': self.app_id,
             'mch_id': self.merchant_id,
@@ -83,9 +187,23 @@ class WechatPay(object):
         sign = self.generate_sign(data)
 
         data.update({'sign': sign})
+        return data
 
-        xml_data = common.trans_dict_to_xml(data)  # 字典转xml
+    def apply_refund(self, params: dict):
+        """
+        申请退款
+        params字段如下:
+         total_fee: 订单总金额，单位为分
+         refund_fee: 退款总金额，单位为分
+         out_refund_no: 商户系统内部的退款单号，商户系统内部唯一，同一退款单号多次请求只退一笔
+         transaction_id: 可选，微信订单号
+         out_trade_no: 商户系统内部的订单号，与 transaction_id 二选一
+         nonce_str: 随机字符串
+        :return: 返回的结果数据
+        """
+
+        data = self.refund_data(params)
 
-        result = requests.post(url=self.refund_url, data=xml_data, cert=(self.cert_path, self.cert_key_path))
+        xml_data = common.trans_dict_to_xml(data)  # 字典转xml
 
-        return result
+        return self._gateway_post('wechat.refund', self.cert_http, self.refund_url, xml_data, strict=False)[0]
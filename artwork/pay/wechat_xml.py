@@ -0,0 +1,102 @@
+"""微信支付扁平xml编解码
+微信支付的请求与回调均为只有一层的<xml>文档,不需要通用xml库:
+dumps: 字典转xml,含特殊字符的值使用CDATA
+loads: xml转字典,不处理DOCTYPE与实体声明,避免实体扩展攻击
+"""
+import re
+
+_ELEMENT = re.compile(rb'\s*<([A-Za-z_][\w.-]*)\s*(?:/>|>(?:\s*((?:<!\[CDATA\[.*?\]\]>\s*)+)|([^<]*))</\1\s*>)', re.S)
+_CDATA = re.compile(rb'<!\[CDATA\[(.*?)\]\]>', re.S)
+_DOCUMENT_START = re.compile(rb'\s*(?:<\?xml[^>]*\?>\s*)?<xml\s*>')
+_DOCUMENT_END = re.compile(rb'\s*</xml\s*>\s*')
+_ENTITY = re.compile(r'&(#x[0-9a-fA-F]+|#[0-9]+|lt|gt|amp|quot|apos);')
+_ENTITIES = {'lt': '<', 'gt': '>', 'amp': '&', 'quot': '"', 'apos': "'"}
+_SPECIAL = re.compile(r'[<>&]')
+
+
+class XMLDecodeError(ValueError):
+    """xml格式错误"""
+
+
+def _cdata(value: str) -> str:
+    """包装CDATA,值内的']]>'拆分到两段CDATA中"""
+    return '<![CDATA[{}]]>'.format(value.replace(']]>', ']]]]><![CDATA[>'))
+
+
+def dumps(data: dict, sort: bool = True) -> bytes:
+    """字典转XML
+    :param data: 一层字典表,None值输出为空元素
+    :param sort: 是否按key排序
+    :return: utf-8编码的xml
+    """
+
+    keys = sorted(data) if sort else data
+    parts = ['<xml>']
+    append = parts.append
+    for key in keys:
+        value = data[key]
+        if value is None:
+            value = ''
+        elif not isinstance(value, str):
+            value = str(value)
+        elif key == 'detail':
+            if not value.startswith('<![CDATA['):  # 只有detail允许传入已包装CDATA的值
+                value = _cdata(value)
+        elif _SPECIAL.search(value):
+            value = _cdata(value)
+        append(f'<{key}>{value}</{key}>')
+    append('</xml>')
+    return ''.join(parts).encode('utf-8')
+
+
+def _unescape_entity(match) -> str:
+    name = match.group(1)
+    if name[0] == '#':
+        try:
+            return chr(int(name[2:], 16) if name[1] in 'xX' else int(name[1:]))
+        except (ValueError, OverflowError):
+            raise XMLDecodeError(f'invalid character reference &{name};')
+    return _ENTITIES[name]
+
+
+def loads(data) -> dict:
+    """XML转字典
+    只接受一层<xml>文档,空元素的值为None,与xmltodict.parse一致,CDATA前后的空白忽略
+    :param data: bytes或str
+    :raise XMLDecodeError: 格式错误,非法字符引用或非utf-8内容
+    :return: {key: value}
+    """
+
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+
+    start = _DOCUMENT_START.match(data)
+    if start is None:
+        raise XMLDecodeError('not a wechat xml document')
+
+    result = dict()
+    pos = start.end()
+    match = _ELEMENT.match
+    while True:
+        element = match(data, pos)
+        if element is None:
+            break
+        key, cdata, text = element.groups()
+        try:
+            if cdata is not None:
+                value = _CDATA.sub(rb'\1', cdata.rstrip()).decode('utf-8')  # 多段CDATA之间的空白保留,与xmltodict一致
+            elif text:
+                value = text.decode('utf-8')
+                if '&' in value:
+                    value = _ENTITY.sub(_unescape_entity, value)
+                value = value.strip() or None
+            else:
+                value = None
+        except UnicodeDecodeError:
+            raise XMLDecodeError(f'invalid utf-8 at {pos}')
+        result[key.decode('utf-8')] = value
+        pos = element.end()
+
+    if _DOCUMENT_END.fullmatch(data, pos) is None:
+        raise XMLDecodeError(f'unexpected content at {pos}')
+    return result
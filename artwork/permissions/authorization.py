@@ -1,15 +1,96 @@
 """auth"""
-import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
 from functools import wraps
 from itsdangerous import BadSignature
 from flask import g, request
 from flask_httpauth import HTTPTokenAuth
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
-from artwork.common import error, public
+from artwork.common import error
+from artwork.permissions.user_cache import user_info_cache
 
 auth = HTTPTokenAuth()
 serializer = Serializer(secret_key="""config.SECRET_KEY""", expires_in=3600 * 24 * 90)
 
+TOKEN_CACHE_SIZE = 10000  # 进程内已验证token缓存数量上限
+TOKEN_CACHE_TTL = 300  # 已验证token缓存有效期,秒
+TOKEN_IAT_STALENESS = 30  # 距上次核对iat超过此秒数后,重新从Redis核对iat
+
+
+class TokenCache:
+    """进程内已验证token缓存(LRU+TTL)
+    以token摘要为键,命中时直接返回已验证的payload,不再重复签名校验与json解码.
+    """
+
+    def __init__(self, maxsize: int = TOKEN_CACHE_SIZE, ttl: float = TOKEN_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items = OrderedDict()  # {digest: [payload, expire_at, iat_checked_at]}
+        self._users = dict()  # {sub: {digest}} 按用户失效时使用
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def digest(token: str) -> str:
+        """token摘要"""
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, digest: str):
+        """获取缓存
+        :return: [payload, expire_at, iat_checked_at] or None
+        """
+        with self._lock:
+            item = self._items.get(digest)
+            if item is None:
+                return None
+            if item[1] <= time.time():
+                self._remove(digest)
+                return None
+            self._items.move_to_end(digest)
+            return item
+
+    def set(self, digest: str, payload: dict, expire_at: float = None):
+        """写入缓存
+        :param expire_at: token本身的过期时间戳,缓存不会超过此时间
+        """
+        now = time.time()
+        expire = now + self.ttl if expire_at is None else min(now + self.ttl, expire_at)
+        with self._lock:
+            self._remove(digest)
+            self._items[digest] = [payload, expire, now]
+            self._users.setdefault(payload.get('sub'), set()).add(digest)
+            while len(self._items) > self.maxsize:
+                self._remove(next(iter(self._items)))
+
+    def invalidate(self, digest: str):
+        """失效单个token"""
+        with self._lock:
+            self._remove(digest)
+
+    def invalidate_user(self, sub):
+        """失效用户所有token"""
+        with self._lock:
+            for digest in list(self._users.get(sub, ())):
+                self._remove(digest)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._users.clear()
+
+    def _remove(self, digest: str):
+        item = self._items.pop(digest, None)
+        if item is not None:
+            digests = self._users.get(item[0].get('sub'))
+            if digests is not None:
+                digests.discard(digest)
+                if not digests:
+                    self._users.pop(item[0].get('sub'), None)
+
+
+token_cache = TokenCache()
+
 
 def authorization_to_dict(authorization: str) -> dict:
     """HTTP头Authorization转换数据类型为dict"""
@@ -23,9 +104,20 @@ def authorization_to_dict(authorization: str) -> dict:
     return result
 
 
+def _check_iat(payload: dict):
+    """核对token签发时间,用户退出登录或修改密码后旧token失效"""
+    sub = payload.get('sub')  # 获取用户uuid
+    iat = """Redis.get(f'{config.USER_REDIS_KEY_PREFIX}_IAT_{sub}')"""
+    if not iat:
+        raise error.ViewException(error_code=4003, message='token失效')
+    if float(iat) != payload.get('iat'):
+        raise error.ViewException(error_code=4003, message='token失效')
+
+
 @auth.verify_token
 def _verify_token(authorization):
     """验证token,@auth.login_required 所调用的验证逻辑
+    已验证的token进入进程内缓存,TOKEN_IAT_STALENESS秒内不重复核对iat;同一请求内只验证一次.
     :param authorization:HTTP.Headers.Authorization
     """
     authorization = authorization_to_dict(authorization)  # 解析Authorization数据,返回dict类型数据集合
@@ -33,23 +125,49 @@ def _verify_token(authorization):
     token = authorization.get('token', None)  # 获取token值
     try:
         assert token, 'authorization failed'
-        payload = serializer.loads(token)  # 尝试解密token
-        sub = payload.get('sub')  # 获取用户uuid
-        iat = """Redis.get(f'{config.USER_REDIS_KEY_PREFIX}_IAT_{sub}')"""
-        if not iat:
-            raise error.ViewException(error_code=4003, message='token失效')
-        if float(iat) != payload.get('iat'):
-            raise error.ViewException(error_code=4003, message='token失效')
+        digest = token_cache.digest(token)
+
+        # 同一请求内已验证过(check_sign_in与@login同时使用)
+        if getattr(g, '_token_digest', None) == digest:
+            return True
+
+        cached = token_cache.get(digest)
+        if cached is not None:
+            payload = cached[0]
+            if time.time() - cached[2] > TOKEN_IAT_STALENESS:
+                try:
+                    _check_iat(payload)
+                except error.ViewException:
+                    token_cache.invalidate(digest)
+                    raise
+                cached[2] = time.time()
+        else:
+            payload, header = serializer.loads(token, return_header=True)  # 尝试解密token
+            _check_iat(payload)
+            token_cache.set(digest, payload, expire_at=header.get('exp'))
     except AssertionError as err:
         raise error.ViewException(error_code=4001, message=str(err))
 
     except BadSignature:
         raise error.ViewException(error_code=4002, message='signature failure')
     else:
-        g.user = payload  # 刷新token时调用
+        g.user = dict(payload)  # 刷新token时调用;复制一份,视图修改g.user不影响缓存中的payload
+        g._token_digest = digest
         return True
 
 
+def invalidate_token(token: str):
+    """退出登录时调用,使token缓存失效"""
+    token_cache.invalidate(token_cache.digest(token))
+
+
+def invalidate_user_tokens(sub):
+    """修改密码等需要使用户所有token失效时调用
+    :param sub: 用户uuid
+    """
+    token_cache.invalidate_user(sub)
+
+
 class LoginVerify:
     """login权限装饰器验证逻辑"""
 
@@ -99,27 +217,21 @@ def check_sign_in():
 
 
 def get_user_info(error_out: bool = True):
-    """获取用户数据:缓存数据"""
+    """获取用户数据:缓存数据
+    优先读取进程内已解码的用户对象,见user_cache.UserInfoCache
+    """
 
-    def _get_user_info():
-        _info = getattr(g, '_info', None)
-        if _info:
-            return _info
+    result = getattr(g, '_info', None)
+    if result is None:
         user_info = getattr(g, 'user', None)
         if user_info and user_info.get('sub', None):
-            user_uuid = user_info.get('sub')
-            g._info = """Redis.get(f'{config.USER_REDIS_KEY_PREFIX}_info_{user_uuid}')"""
-            return g._info
-        else:
-            return None
+            try:
+                result = user_info_cache.get(user_info.get('sub'))
+            except Exception:
+                raise error.ViewException(error_code=5001, message='用户数据异常!!!')
+            g._info = result
 
-    result = _get_user_info()
     if result:
-        try:
-            result = public.NeoDict(**json.loads(result))
-        except:
-            raise error.ViewException(error_code=5001, message='用户数据异常!!!')
-        else:
-            return result
+        return result
     elif error_out is True:
         raise error.ViewException(error_code=5001, message='用户数据异常!!!')
@@ -0,0 +1,190 @@
+"""密码哈希服务
+哈希计算与校验在进程池中执行,不阻塞请求线程;提交数量有上限,超过时等待.
+校验成功且存储的哈希算法或强度低于当前配置时,同时返回按当前配置重新计算的哈希.
+示例:
+    ok, new_hash = password_hasher.check_and_rehash(user._password, raw)
+    ok, new_hash = await password_hasher.check_and_rehash_async(user._password, raw)
+"""
+import os
+import asyncio
+import hashlib
+import inspect
+import weakref
+import threading
+from concurrent.futures import ProcessPoolExecutor, Future
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# werkzeug格式,例如 pbkdf2:sha256:600000 或 scrypt:32768:8:1,默认与werkzeug的默认算法一致
+PASSWORD_METHOD = inspect.signature(generate_password_hash).parameters['method'].default
+PASSWORD_SALT_LENGTH = 16
+PASSWORD_WORKERS = None  # 进程池大小,默认为CPU核数,0时在调用线程中计算
+PASSWORD_MAX_PENDING = 256  # 同时提交到进程池的任务数上限
+
+
+def _hash(raw: str, method: str, salt_length: int) -> str:
+    return generate_password_hash(raw, method=method, salt_length=salt_length)
+
+
+def _strength(prefix: str) -> tuple:
+    """哈希前缀的强度,可比较大小: (算法等级, 强度)
+    scrypt高于pbkdf2,pbkdf2高于其他旧算法;同一算法比较n*r*p,或迭代次数与摘要长度
+    """
+    parts = prefix.split(':')
+    try:
+        if parts[0] == 'scrypt':
+            n, r, p = (int(part) for part in parts[1:4])
+            return 2, n * r * p, 0
+        if parts[0] == 'pbkdf2':
+            return 1, int(parts[2]), hashlib.new(parts[1]).digest_size
+    except (ValueError, IndexError):
+        pass
+    return 0, 0, 0
+
+
+def _weaker(pwhash: str, current: str) -> bool:
+    """存储的哈希是否弱于当前配置,更强的哈希不会被重新计算为较弱的配置"""
+    return _strength(pwhash.split('$', 1)[0]) < _strength(current)
+
+
+def _check_and_rehash(pwhash: str, raw: str, method: str, salt_length: int, current: str) -> tuple:
+    """校验密码,成功且存储的哈希弱于current时重新计算
+    :return: (是否正确, 新哈希 or None)
+    """
+    if not check_password_hash(pwhash, raw):
+        return False, None
+    if not _weaker(pwhash, current):
+        return True, None
+    return True, generate_password_hash(raw, method=method, salt_length=salt_length)
+
+
+class PasswordHasher:
+    """密码哈希服务,进程池在首次使用时创建,fork后子进程重新创建"""
+
+    _instances = weakref.WeakSet()
+
+    def __init__(self, method: str = PASSWORD_METHOD, salt_length: int = PASSWORD_SALT_LENGTH,
+                 workers: int = PASSWORD_WORKERS, max_pending: int = PASSWORD_MAX_PENDING):
+        """
+        :param method: 哈希算法与强度,werkzeug.security.generate_password_hash的method参数
+        :param salt_length: 盐长度
+        :param workers: 进程数,0时不使用进程池
+        :param max_pending: 同时提交到进程池的任务数上限
+        """
+        self.method = method
+        self.salt_length = salt_length
+        self.workers = workers
+        self.max_pending = max_pending
+        self._current = None
+        self._reset()
+        self._instances.add(self)
+
+    def configure(self, method: str = None, salt_length: int = None, workers: int = None):
+        """应用初始化时修改配置,参数见__init__"""
+        if method is not None:
+            self.method = method
+            self._current = None
+        if salt_length is not None:
+            self.salt_length = salt_length
+        if workers is not None:
+            self.shutdown()
+            self.workers = workers
+
+    def _reset(self):
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = threading.BoundedSemaphore(self.max_pending)
+
+    @classmethod
+    def _after_fork(cls):
+        for hasher in list(cls._instances):
+            hasher._reset()
+
+    @property
+    def current(self) -> str:
+        """当前配置生成的哈希前缀,如 pbkdf2:sha256:600000,用于判断是否需要重新计算"""
+        if self._current is None:
+            self._current = generate_password_hash('', method=self.method, salt_length=1).split('$', 1)[0]
+        return self._current
+
+    def needs_rehash(self, pwhash: str) -> bool:
+        """存储的哈希是否弱于当前配置"""
+        return _weaker(pwhash, self.current)
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def _submit(self, func, *args, acquired: bool = False) -> Future:
+        """提交到进程池,超过max_pending时阻塞等待
+        :param acquired: 调用方已占用一个提交名额
+        """
+        if self.workers == 0:
+            future = Future()
+            try:
+                future.set_result(func(*args))
+            except Exception as err:
+                future.set_exception(err)
+            return future
+
+        if not acquired:
+            self._pending.acquire()
+        try:
+            future = self.executor.submit(func, *args)
+        except BaseException:
+            self._pending.release()
+            raise
+        future.add_done_callback(lambda _: self._pending.release())
+        return future
+
+    async def _submit_async(self, func, *args):
+        """协程版本,等待提交名额时不阻塞事件循环"""
+        loop = asyncio.get_running_loop()
+        pending = self._pending
+        if self.workers != 0 and not pending.acquire(blocking=False):
+            acquiring = loop.run_in_executor(None, pending.acquire)
+            try:
+                await asyncio.shield(acquiring)
+            except asyncio.CancelledError:
+                # 线程中的acquire仍会完成,完成后归还名额,避免取消(如客户端断开)导致名额永久减少
+                acquiring.add_done_callback(lambda f: f.cancelled() or f.exception() or pending.release())
+                raise
+        return await asyncio.wrap_future(self._submit(func, *args, acquired=True), loop=loop)
+
+    def hash(self, raw: str) -> str:
+        """计算密码哈希"""
+        return self._submit(_hash, raw, self.method, self.salt_length).result()
+
+    def check_and_rehash(self, pwhash: str, raw: str) -> tuple:
+        """校验密码
+        :return: (是否正确, 新哈希 or None),新哈希不为None时调用方应保存
+        """
+        return self._submit(_check_and_rehash, pwhash, raw, self.method, self.salt_length, self.current).result()
+
+    def check(self, pwhash: str, raw: str) -> bool:
+        """校验密码"""
+        return self.check_and_rehash(pwhash, raw)[0]
+
+    async def hash_async(self, raw: str) -> str:
+        return await self._submit_async(_hash, raw, self.method, self.salt_length)
+
+    async def check_and_rehash_async(self, pwhash: str, raw: str) -> tuple:
+        return await self._submit_async(_check_and_rehash, pwhash, raw, self.method, self.salt_length, self.current)
+
+    async def check_async(self, pwhash: str, raw: str) -> bool:
+        return (await self.check_and_rehash_async(pwhash, raw))[0]
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=PasswordHasher._after_fork)
+
+password_hasher = PasswordHasher()
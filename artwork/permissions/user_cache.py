@@ -0,0 +1,189 @@
+"""用户数据两级缓存
+一级: 进程内缓存,保存已解码的只读用户对象
+二级: Redis,保存用户数据json与版本号
+用户数据变更时调用 UserInfoCache.publish 更新版本号并广播,各进程的一级缓存随之失效.
+"""
+import time
+import keyword
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from artwork.common import public, json_codec
+
+USER_INFO_CACHE_SIZE = 10000  # 进程内缓存用户数量上限
+USER_INFO_STALENESS = 5  # 一级缓存超过此秒数后,向Redis核对版本号
+
+
+class UserInfo(Mapping):
+    """只读用户数据对象,字段由子类的__slots__决定
+    同时是只读Mapping,可以像原来的NeoDict一样迭代,取长度,调用items()与json编码
+    """
+    __slots__ = ()
+    _fields = frozenset()  # __slots__的集合,用于限定按key取值的范围
+
+    def __init__(self, data: dict):
+        for key in self.__slots__:
+            object.__setattr__(self, key, data[key])
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f'{self.__class__.__name__} is read-only')
+
+    def __delattr__(self, item):
+        raise AttributeError(f'{self.__class__.__name__} is read-only')
+
+    def __getitem__(self, item):
+        if item not in self._fields:
+            raise KeyError(item)
+        return getattr(self, item)
+
+    def __contains__(self, item):
+        return item in self._fields
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def get(self, item, default=None):
+        if item not in self._fields:
+            return default
+        return getattr(self, item)
+
+    def to_dict(self) -> dict:
+        return {key: getattr(self, key) for key in self.__slots__}
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.to_dict()}>'
+
+
+_user_info_classes = dict()  # {字段集合: UserInfo子类}
+_reserved_names = frozenset(dir(UserInfo))  # 与UserInfo/Mapping的属性与方法同名的字段会覆盖它们
+
+
+def decode_user_info(raw):
+    """解码Redis中的用户数据
+    字段名均为合法标识符且不与UserInfo的属性同名时返回只读UserInfo对象,否则返回public.NeoDict
+    """
+
+    data = json_codec.loads(raw)
+    keys = tuple(sorted(data))
+    cls = _user_info_classes.get(keys)
+    if cls is None:
+        if not all(key.isidentifier() and not keyword.iskeyword(key) and key not in _reserved_names
+                   for key in keys):
+            return public.NeoDict(**data)
+        cls = type('UserInfo', (UserInfo,), {'__slots__': keys, '_fields': frozenset(keys)})
+        _user_info_classes[keys] = cls
+    return cls(data)
+
+
+class UserInfoCache:
+    """用户数据两级缓存
+    redis: 需要实现get/set/incr/publish方法的客户端,测试时可使用内存实现替代
+    """
+
+    def __init__(self, redis=None, key_prefix: str = """config.USER_REDIS_KEY_PREFIX""",
+                 maxsize: int = USER_INFO_CACHE_SIZE, staleness: float = USER_INFO_STALENESS,
+                 channel: str = 'user_info_invalidate'):
+        self.redis = redis
+        self.key_prefix = key_prefix
+        self.maxsize = maxsize
+        self.staleness = staleness
+        self.channel = channel
+        self._items = OrderedDict()  # {user_uuid: [info, version, checked_at]}
+        self._lock = threading.Lock()
+
+    def init_redis(self, redis):
+        """应用初始化时设置Redis客户端"""
+        self.redis = redis
+
+    def info_key(self, user_uuid) -> str:
+        return f'{self.key_prefix}_info_{user_uuid}'
+
+    def version_key(self, user_uuid) -> str:
+        return f'{self.key_prefix}_info_version_{user_uuid}'
+
+    def get(self, user_uuid):
+        """获取用户数据
+        一级缓存未过期时直接返回,过期后只核对版本号,版本号变化才重新读取并解码用户数据
+        :return: UserInfo or None
+        """
+
+        now = time.time()
+        with self._lock:
+            item = self._items.get(user_uuid)
+            if item is not None:
+                self._items.move_to_end(user_uuid)
+
+        if item is not None:
+            if now - item[2] <= self.staleness:
+                return item[0]
+            version = self.redis.get(self.version_key(user_uuid))
+            if version == item[1]:
+                item[2] = now
+                return item[0]
+
+        return self._load(user_uuid, now)
+
+    def _load(self, user_uuid, now: float):
+        """从Redis读取用户数据,写入一级缓存"""
+
+        version = self.redis.get(self.version_key(user_uuid))
+        raw = self.redis.get(self.info_key(user_uuid))
+        if not raw:
+            self.invalidate(user_uuid)
+            return None
+
+        info = decode_user_info(raw)
+        with self._lock:
+            self._items[user_uuid] = [info, version, now]
+            self._items.move_to_end(user_uuid)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return info
+
+    def invalidate(self, user_uuid):
+        """失效本进程内的用户缓存"""
+        with self._lock:
+            self._items.pop(user_uuid, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def publish(self, user_uuid, info: dict = None):
+        """用户数据变更后调用,更新版本号并通知其他进程
+        :param info: 新的用户数据,传入时同时写入Redis
+        """
+
+        if info is not None:
+            self.redis.set(self.info_key(user_uuid), json_codec.dumps(info))
+        self.redis.incr(self.version_key(user_uuid))
+        self.invalidate(user_uuid)
+        publish = getattr(self.redis, 'publish', None)
+        if publish is not None:
+            publish(self.channel, str(user_uuid))
+
+    def listen(self):
+        """后台线程订阅失效消息,收到后立即失效一级缓存
+        不订阅时依靠版本号核对,最多延迟staleness秒
+        """
+
+        def run():
+            pubsub = self.redis.pubsub()
+            pubsub.subscribe(self.channel)
+            for message in pubsub.listen():
+                if message.get('type') != 'message':
+                    continue
+                user_uuid = message.get('data')
+                if isinstance(user_uuid, bytes):
+                    user_uuid = user_uuid.decode()
+                self.invalidate(user_uuid)
+
+        thread = threading.Thread(target=run, name='user-info-invalidate', daemon=True)
+        thread.start()
+        return thread
+
+
+user_info_cache = UserInfoCache()
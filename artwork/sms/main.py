@@ -1,7 +1,14 @@
 """阿里云短信方案"""
-import json
+import time
+import logging
+import queue
+import threading
+from collections import OrderedDict
 from aliyunsdkcore.client import AcsClient
 from aliyunsdkcore.request import CommonRequest
+from artwork.common import json_codec, metrics
+
+logger = logging.getLogger(__name__)
 
 
 class ViewException(Exception):
@@ -21,10 +28,29 @@ class ViewException(Exception):
 class AliSms:
     """阿里短信接口"""
 
-    def __init__(self, access_id, access_secret):
+    batch_limit = 100  # SendBatchSms 单次请求的手机号数量上限
+
+    def __init__(self, access_id, access_secret, sign_name: str = "寻宝网", client=None):
+        """
+        :param sign_name: 短信签名
+        :param client: 自定义AcsClient,测试时可替换为本地实现
+        """
         self.access_id = access_id
         self.access_secret = access_secret
-        self.client = AcsClient(self.access_id, self.access_secret, 'default')
+        self.sign_name = sign_name
+        self.client = client if client is not None else AcsClient(self.access_id, self.access_secret, 'default')
+
+    @staticmethod
+    def _request(action_name: str) -> CommonRequest:
+        """短信接口公共请求参数"""
+        request = CommonRequest()
+        request.set_accept_format('json')
+        request.set_domain('dysmsapi.aliyuncs.com')
+        request.set_method('POST')
+        request.set_protocol_type('http')  # https | http
+        request.set_version('2017-05-25')
+        request.set_action_name(action_name)
+        return request
 
     def send(self, template_code: str, phone: str, param: dict):
         """发送验证码
@@ -33,22 +59,197 @@ class AliSms:
         :param param:
         :return:
         """
-        request = CommonRequest()
-        request.set_accept_format('json')
-        request.set_domain('dysmsapi.aliyuncs.com')
-        request.set_method('POST')
-        request.set_protocol_type('http')  # https | http
-        request.set_version('2017-05-25')
-        request.set_action_name('SendSms')
+        request = self._request('SendSms')
 
         request.add_query_param('PhoneNumbers', phone)
-        request.add_query_param('SignName', "寻宝网")
+        request.add_query_param('SignName', self.sign_name)
         request.add_query_param('TemplateCode', template_code)
-        request.add_query_param('TemplateParam', json.dumps(param))
+        template_param = json_codec.dumps(param)
+        request.add_query_param('TemplateParam', template_param)
 
-        response = self.client.do_action_with_exception(request)
-        result = json.loads(response.decode())
+        with metrics.gateway.span('aliyun.sms.send') as span:
+            response = self.client.do_action_with_exception(request)
+            result = json_codec.loads(response)
+            span.request_bytes = len(phone) + len(template_param.encode())
+            span.response_bytes = len(response)
+            span.code = result.get('Code', None) or 'UNKNOWN'
 
         if result.get('Code', None) != 'OK':
             raise ViewException(error_code=5005, message='验证码发送失败,请联系管理员!', system_message=result.get('Message', ''))
         return response
+
+    def send_batch(self, template_code: str, phones: list, params) -> dict:
+        """批量发送,按batch_limit拆分后调用SendBatchSms
+        单批失败不会抛出异常,失败的手机号与原因记录在返回值中
+        :param template_code: 短信模板
+        :param phones: 手机号列表
+        :param params: 模板参数,dict为所有手机号共用,list为与phones一一对应
+        :return: {'success': [phone], 'failed': {phone: message}}
+        """
+        if isinstance(params, dict):
+            params = [params] * len(phones)
+
+        result = {'success': list(), 'failed': dict()}
+        for start in range(0, len(phones), self.batch_limit):
+            chunk = phones[start:start + self.batch_limit]
+            chunk_params = params[start:start + self.batch_limit]
+
+            phone_json = json_codec.dumps(chunk)
+            param_json = json_codec.dumps(chunk_params)
+            request = self._request('SendBatchSms')
+            request.add_query_param('PhoneNumberJson', phone_json)
+            request.add_query_param('SignNameJson', json_codec.dumps([self.sign_name] * len(chunk)))
+            request.add_query_param('TemplateCode', template_code)
+            request.add_query_param('TemplateParamJson', param_json)
+
+            with metrics.gateway.span('aliyun.sms.send_batch') as span:
+                span.request_bytes = len(phone_json) + len(param_json.encode())
+                try:
+                    content = self.client.do_action_with_exception(request)
+                    span.response_bytes = len(content)
+                    response = json_codec.loads(content)
+                except Exception as err:
+                    response = {'Code': getattr(err, 'error_code', None) or 'Exception', 'Message': str(err)}
+                span.code = response.get('Code', None) or 'UNKNOWN'
+
+            if response.get('Code', None) == 'OK':
+                result['success'].extend(chunk)
+            else:
+                message = response.get('Message', '') or response.get('Code', '')
+                result['failed'].update((phone, message) for phone in chunk)
+        return result
+
+
+class RateLimiter:
+    """限制每秒请求数(多线程)"""
+
+    def __init__(self, rate: float):
+        """
+        :param rate: 每秒请求数,0为不限制
+        """
+        self.interval = 1 / rate if rate else 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if self._next > now:
+                time.sleep(self._next - now)
+                now = self._next
+            self._next = now + self.interval
+
+
+class SmsQueue:
+    """短信发送队列
+    请求处理函数中只需put入队,后台线程将相同模板的短信合并为SendBatchSms批量发送,并限制发送频率.
+    示例:
+        queue = SmsQueue(AliSms(access_id, access_secret), workers=2, rate=10, on_result=log_result)
+        queue.put('SMS_001', '13800000000', {'code': '1234'})
+    """
+
+    failed_limit = 1000  # failed记录数上限
+
+    def __init__(self, sms: AliSms, workers: int = 2, rate: float = 0, linger: float = 0.05, on_result=None):
+        """
+        :param sms: AliSms
+        :param workers: 发送线程数
+        :param rate: 每秒批量请求数上限,0为不限制
+        :param linger: 等待合并更多短信的最长时间,秒
+        :param on_result: 每个手机号发送后的回调,参数为(template_code, phone, success, message),回调异常只记录日志
+        """
+        self.sms = sms
+        self.linger = linger
+        self.on_result = on_result
+        self.limiter = RateLimiter(rate)
+        self.failed = OrderedDict()  # {phone: message} 未设置on_result时记录最近failed_limit个发送失败的手机号
+        self._queue = queue.Queue()
+        self._closed = False
+        self._threads = [threading.Thread(target=self._worker, name=f'sms-queue-{i}', daemon=True)
+                         for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def put(self, template_code: str, phone: str, param: dict):
+        """短信入队"""
+        if self._closed:
+            raise RuntimeError('SmsQueue is closed')
+        self._queue.put((template_code, phone, param))
+
+    def _collect(self, first) -> list:
+        """从队列中取出最多batch_limit条短信,linger时间内尽量合并"""
+        items = [first]
+        deadline = time.monotonic() + self.linger
+        while len(items) < self.sms.batch_limit:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)  # 留给其他线程退出
+                self._queue.task_done()
+                break
+            items.append(item)
+        return items
+
+    def _worker(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                self._queue.put(None)  # 留给其他线程退出
+                self._queue.task_done()
+                return
+
+            items = [first]
+            try:
+                items = self._collect(first)
+                groups = dict()  # {template_code: [(phone, param)]}
+                for template_code, phone, param in items:
+                    groups.setdefault(template_code, list()).append((phone, param))
+
+                for template_code, group in groups.items():
+                    self.limiter.wait()
+                    try:
+                        result = self.sms.send_batch(template_code, [phone for phone, _ in group],
+                                                     [param for _, param in group])
+                    except Exception as err:
+                        result = {'success': list(), 'failed': {phone: str(err) for phone, _ in group}}
+                    self._report(template_code, result)
+            except Exception:
+                logger.exception('sms queue worker error')
+            finally:
+                for _ in items:
+                    self._queue.task_done()
+
+    def _report(self, template_code: str, result: dict):
+        if self.on_result is None:
+            for phone, message in result['failed'].items():
+                self.failed.pop(phone, None)
+                self.failed[phone] = message
+            while len(self.failed) > self.failed_limit:
+                self.failed.popitem(last=False)
+            return
+
+        results = [(phone, True, '') for phone in result['success']]
+        results += [(phone, False, message) for phone, message in result['failed'].items()]
+        for phone, success, message in results:
+            try:
+                self.on_result(template_code, phone, success, message)
+            except Exception:
+                logger.exception('sms queue on_result callback error')
+
+    def join(self):
+        """等待已入队的短信全部发送完成"""
+        self._queue.join()
+
+    def close(self):
+        """发送完已入队的短信后停止发送线程"""
+        self._closed = True
+        self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
@@ -0,0 +1,199 @@
+"""短信验证码服务
+验证码以哈希形式保存在Redis(或内存实现)中并设置过期时间,不访问数据库.
+发送频率按手机号与IP做滑动窗口限制,计数器为O(1)的双窗口计数.
+发送与校验各最多两次缓存往返.
+示例:
+    service = VerifyCodeService(RedisStore(Redis), sender=lambda phone, code: sms.send('SMS_001', phone, {'code': code}))
+    service.send(phone, ip=request.remote_addr)
+    service.verify(phone, code)
+"""
+import time
+import hmac
+import hashlib
+import threading
+from artwork.common import error, public
+
+
+class RedisStore:
+    """Redis存储,一组操作使用一次pipeline往返"""
+
+    def __init__(self, redis):
+        self.redis = redis
+
+    def execute(self, operations: list) -> list:
+        """执行一组操作
+        :param operations: [('incr', key, ttl), ('get', key), ('set', key, value, ttl), ('delete', key)]
+        :return: 每个操作的结果
+        """
+        pipeline = self.redis.pipeline(transaction=False)
+        for operation in operations:
+            command = operation[0]
+            if command == 'incr':
+                pipeline.set(operation[1], 0, ex=operation[2], nx=True)  # 计数器不存在时创建并设置过期时间
+                pipeline.incr(operation[1])
+            elif command == 'get':
+                pipeline.get(operation[1])
+            elif command == 'set':
+                pipeline.set(operation[1], operation[2], ex=operation[3])
+            elif command == 'delete':
+                pipeline.delete(operation[1])
+        results = pipeline.execute()
+
+        # 去掉创建计数器的返回值
+        output = list()
+        position = 0
+        for operation in operations:
+            if operation[0] == 'incr':
+                position += 1
+            output.append(results[position])
+            position += 1
+        return output
+
+
+class MemoryStore:
+    """内存存储,单进程或测试时替代Redis"""
+
+    def __init__(self):
+        self._items = dict()  # {key: (value, expire_at)}
+        self._lock = threading.Lock()
+
+    def _get(self, key, now):
+        item = self._items.get(key)
+        if item is None:
+            return None
+        if item[1] is not None and item[1] <= now:
+            del self._items[key]
+            return None
+        return item[0]
+
+    def execute(self, operations: list) -> list:
+        """执行一组操作,参数见RedisStore.execute"""
+        now = time.time()
+        output = list()
+        with self._lock:
+            for operation in operations:
+                command, key = operation[0], operation[1]
+                if command == 'incr':
+                    value = self._get(key, now)
+                    if value is None:
+                        self._items[key] = (1, now + operation[2])
+                        output.append(1)
+                    else:
+                        self._items[key] = (value + 1, self._items[key][1])
+                        output.append(value + 1)
+                elif command == 'get':
+                    output.append(self._get(key, now))
+                elif command == 'set':
+                    self._items[key] = (operation[2], now + operation[3])
+                    output.append(True)
+                elif command == 'delete':
+                    output.append(1 if self._items.pop(key, None) is not None else 0)
+        return output
+
+
+class VerifyCodeService:
+    """短信验证码"""
+
+    def __init__(self, store, sender=None, secret_key: str = """config.SECRET_KEY""", key_prefix: str = 'verify_code',
+                 length: int = 4, ttl: int = 300, max_attempts: int = 5,
+                 phone_limits: tuple = ((60, 1), (3600, 10)), ip_limits: tuple = ((3600, 50),)):
+        """
+        :param store: RedisStore 或 MemoryStore
+        :param sender: 发送函数,参数为(phone, code),例如调用AliSms.send
+        :param secret_key: 验证码哈希密钥
+        :param length: 验证码长度
+        :param ttl: 验证码有效期,秒
+        :param max_attempts: 单个验证码允许的校验次数
+        :param phone_limits: 每个手机号的发送限制 ((窗口秒数, 次数),)
+        :param ip_limits: 每个IP的发送限制 ((窗口秒数, 次数),)
+        """
+        self.store = store
+        self.sender = sender
+        self.secret_key = secret_key.encode()
+        self.key_prefix = key_prefix
+        self.length = length
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        self.phone_limits = phone_limits
+        self.ip_limits = ip_limits
+
+    def _hash(self, phone: str, code: str) -> str:
+        return hmac.new(self.secret_key, f'{phone}:{code}'.encode(), hashlib.sha256).hexdigest()
+
+    def _code_key(self, phone: str) -> str:
+        return f'{self.key_prefix}:code:{phone}'
+
+    def _attempts_key(self, phone: str) -> str:
+        return f'{self.key_prefix}:attempts:{phone}'
+
+    def _limit_operations(self, now: float, name: str, value: str, limits: tuple) -> list:
+        """滑动窗口计数: 本窗口计数+1,读取上一窗口计数"""
+        operations = list()
+        for window, _ in limits:
+            current = int(now // window)
+            operations.append(('incr', f'{self.key_prefix}:{name}:{value}:{window}:{current}', window * 2))
+            operations.append(('get', f'{self.key_prefix}:{name}:{value}:{window}:{current - 1}'))
+        return operations
+
+    @staticmethod
+    def _over_limit(now: float, limits: tuple, results: list) -> bool:
+        """按上一窗口剩余比例加权估算滑动窗口内的次数"""
+        for index, (window, count) in enumerate(limits):
+            current, previous = results[index * 2], results[index * 2 + 1]
+            weight = 1 - (now % window) / window
+            if int(current) + int(previous or 0) * weight > count:
+                return True
+        return False
+
+    def send(self, phone: str, ip: str = None) -> str:
+        """生成并发送验证码
+        :param phone: 手机号
+        :param ip: 请求IP,None时不做IP限制
+        :return: 验证码
+        """
+
+        now = time.time()
+        ip_limits = self.ip_limits if ip else ()
+        operations = self._limit_operations(now, 'phone', phone, self.phone_limits)
+        operations += self._limit_operations(now, 'ip', ip, ip_limits)
+        results = self.store.execute(operations)
+
+        phone_count = len(self.phone_limits) * 2
+        if self._over_limit(now, self.phone_limits, results[:phone_count]) or \
+                self._over_limit(now, ip_limits, results[phone_count:]):
+            raise error.ViewException(error_code=5006, message='验证码发送过于频繁,请稍后重试!')
+
+        code = public.generate_verify_code(self.length)
+        self.store.execute([
+            ('set', self._code_key(phone), self._hash(phone, code), self.ttl),
+            ('delete', self._attempts_key(phone))
+        ])
+
+        if self.sender is not None:
+            self.sender(phone, code)
+        return code
+
+    def verify(self, phone: str, code: str) -> bool:
+        """校验验证码,校验成功后验证码失效
+        :raise ViewException: 验证码错误,过期或校验次数过多
+        """
+
+        stored, attempts = self.store.execute([
+            ('get', self._code_key(phone)),
+            ('incr', self._attempts_key(phone), self.ttl)
+        ])
+
+        if not stored:
+            raise error.ViewException(error_code=5007, message='验证码错误或已过期!')
+        if isinstance(stored, bytes):
+            stored = stored.decode()
+
+        if int(attempts) > self.max_attempts:
+            self.store.execute([('delete', self._code_key(phone)), ('delete', self._attempts_key(phone))])
+            raise error.ViewException(error_code=5008, message='验证码错误次数过多,请重新获取!')
+
+        if not hmac.compare_digest(stored, self._hash(phone, str(code))):
+            raise error.ViewException(error_code=5007, message='验证码错误或已过期!')
+
+        self.store.execute([('delete', self._code_key(phone)), ('delete', self._attempts_key(phone))])
+        return True
@@ -2,14 +2,259 @@
 author:Neo
 """
 
-import copy
+import time
 import datetime
 import decimal
+import functools
+import threading
+from collections import OrderedDict
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
-from sqlalchemy import Column, SmallInteger, TIMESTAMP, Integer
+from sqlalchemy import Column, SmallInteger, TIMESTAMP, Integer, Table, MetaData, event
+from sqlalchemy import types, inspect
+from sqlalchemy.orm import Session, with_loader_criteria
+from artwork.common import json_codec
+from artwork.permissions.password import password_hasher
 
-db = SQLAlchemy()
+try:
+    from flask_sqlalchemy.query import Query as BaseQuery
+except ImportError:
+    from flask_sqlalchemy import BaseQuery
+
+
+class Query(BaseQuery):
+    """默认查询类,Common模型的查询自动过滤逻辑删除(status=0)的记录"""
+
+    def with_deleted(self):
+        """查询包含逻辑删除的记录
+        示例: Model.query.with_deleted().filter_by(id=1).first()
+        """
+        return self.execution_options(include_deleted=True)
+
+
+db = SQLAlchemy(query_class=Query)
+
+SERIALIZER_PLAN_CACHE_SIZE = 512  # 序列化计划缓存上限,按(模型, increase, remove)组合计数
+
+# 值必定不需要转换的字段类型,序列化时直接透传
+_PASSTHROUGH_TYPES = (types.Integer, types.String, types.Boolean, types.Date, types.Time, types.Float, types.Enum)
+
+
+def _format_datetime(value):
+    """格式化时间类型字段"""
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return value
+
+
+def _decimal_to_float(value):
+    """格式化Decimal类型字段"""
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    return value
+
+
+def _convert_value(value):
+    """未知字段类型的通用转换,与字段类型无关"""
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    elif isinstance(value, decimal.Decimal):
+        return float(value)
+    return value
+
+
+def _column_converter(column):
+    """根据字段类型选择值转换函数,None表示直接透传"""
+    column_type = column.type
+    if isinstance(column_type, types.DateTime):
+        return _format_datetime
+    if isinstance(column_type, types.Numeric) and column_type.asdecimal:
+        return _decimal_to_float
+    if isinstance(column_type, _PASSTHROUGH_TYPES):
+        return None
+    return _convert_value
+
+
+@functools.lru_cache(maxsize=SERIALIZER_PLAN_CACHE_SIZE)
+def _compile_serializer_plan(model, increase: frozenset, remove: frozenset, privacy: bool = True) -> tuple:
+    """编译模型序列化计划,每个模型类与(increase, remove)组合只编译一次
+    :param model: 模型类
+    :param increase: 需要(增加/显示)的序列化输出的字段
+    :param remove: 需要(去除/隐藏)的序列化输出的字段
+    :param privacy: 是否过滤模型的_privacy_fields
+    :return: ((field_name, converter), ...) 按模型字段声明顺序排列
+    """
+
+    hidden = (set(model._privacy_fields) - increase) | remove if privacy else remove
+    return tuple((column.name, _column_converter(column))
+                 for column in model.__table__.columns if column.name not in hidden)
+
+
+def _column_decoder(column):
+    """行缓存从Redis解码后的值还原函数,None表示直接使用
+    Date/Time在序列化时透传,json编码后为iso格式字符串,需要还原为与serialization一致的类型
+    """
+    column_type = column.type
+    if isinstance(column_type, types.DateTime):
+        return None  # 序列化时已格式化为字符串
+    if isinstance(column_type, types.Date):
+        return datetime.date.fromisoformat
+    if isinstance(column_type, types.Time):
+        return datetime.time.fromisoformat
+    return None
+
+
+@functools.lru_cache(maxsize=SERIALIZER_PLAN_CACHE_SIZE)
+def _row_cache_decoders(model) -> tuple:
+    """行缓存字段值的还原函数,与全字段序列化计划的字段顺序一致"""
+    return tuple(_column_decoder(column) for column in model.__table__.columns)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _filter_deleted(execute_state):
+    """为Common模型的ORM查询(含关系加载)追加 status IS DISTINCT FROM 0 条件(status为NULL的行仍可见),
+    execution_options(include_deleted=True)时跳过"""
+
+    if execute_state.is_select and not execute_state.execution_options.get('include_deleted', False):
+        execute_state.statement = execute_state.statement.options(
+            with_loader_criteria(Common, lambda cls: cls.status.is_distinct_from(0), include_aliases=True)
+        )
+
+
+class RowCache:
+    """按主键缓存的模型行数据
+    一级: 进程内LRU,有效期local_ttl秒;二级: Redis,有效期ttl秒.
+    缓存值为按模型字段顺序排列的序列化字段值列表,从Redis读取时还原Date/Time类型,两级缓存返回的值一致.
+    """
+
+    def __init__(self, redis=None, maxsize: int = 10000, local_ttl: float = 5, ttl: int = 300,
+                 key_prefix: str = 'row_cache'):
+        """
+        :param redis: 需要实现get/set/delete方法的客户端,None时只使用进程内缓存
+        :param maxsize: 进程内缓存数量上限
+        :param local_ttl: 进程内缓存有效期,其他进程修改数据后最多延迟此秒数生效
+        :param ttl: Redis缓存有效期,秒
+        """
+        self.redis = redis
+        self.maxsize = maxsize
+        self.local_ttl = local_ttl
+        self.ttl = ttl
+        self.key_prefix = key_prefix
+        self._items = OrderedDict()  # {key: (values, expire_at)}
+        self._lock = threading.Lock()
+        self._stats = {'local_hits': 0, 'redis_hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def init_redis(self, redis):
+        """应用初始化时设置Redis客户端"""
+        self.redis = redis
+
+    def key(self, model, ident) -> str:
+        return f'{self.key_prefix}:{model.__table__.name}:{ident}'
+
+    def get(self, model, ident):
+        """读取缓存
+        :return: 字段值列表,未命中时返回None
+        """
+        key = self.key(model, ident)
+        now = time.time()
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and item[1] > now:
+                self._items.move_to_end(key)
+                self._stats['local_hits'] += 1
+                return item[0]
+
+        if self.redis is not None:
+            raw = self.redis.get(key)
+            if raw:
+                values = [value if decoder is None or value is None else decoder(value)
+                          for value, decoder in zip(json_codec.loads(raw), _row_cache_decoders(model))]
+                self._set_local(key, values, now)
+                with self._lock:
+                    self._stats['redis_hits'] += 1
+                return values
+
+        with self._lock:
+            self._stats['misses'] += 1
+        return None
+
+    def set(self, model, ident, values: list):
+        """写入缓存"""
+        key = self.key(model, ident)
+        self._set_local(key, values, time.time())
+        if self.redis is not None:
+            self.redis.set(key, json_codec.dumps_bytes(values), ex=self.ttl)
+
+    def _set_local(self, key: str, values: list, now: float):
+        with self._lock:
+            self._items[key] = (values, now + self.local_ttl)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def invalidate(self, model, ident):
+        """失效缓存"""
+        key = self.key(model, ident)
+        with self._lock:
+            self._items.pop(key, None)
+            self._stats['invalidations'] += 1
+        if self.redis is not None:
+            self.redis.delete(key)
+
+    def clear(self):
+        """清空进程内缓存与统计"""
+        with self._lock:
+            self._items.clear()
+            for key in self._stats:
+                self._stats[key] = 0
+
+    def stats(self) -> dict:
+        """命中统计"""
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats['local_hits'] + stats['redis_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['local_hits'] + stats['redis_hits']) / lookups if lookups else 0
+        stats['size'] = len(self._items)
+        return stats
+
+
+row_cache = RowCache()
+
+_ROW_CACHE_PENDING = 'row_cache_pending'  # session.info中待失效的行缓存 {(模型, 主键)}
+
+
+def _defer_row_cache_invalidate(session, model, idents):
+    """记录待失效的行缓存,事务提交后再失效,避免提交前其他请求重新加载旧数据写入缓存"""
+    session.info.setdefault(_ROW_CACHE_PENDING, set()).update((model, ident) for ident in idents)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_row_cache(session, flush_context):
+    """flush时收集被修改或删除的开启了行缓存的对象"""
+
+    for instance in list(session.dirty) + list(session.deleted):
+        if getattr(instance, '_cache_rows', False) and isinstance(instance, Common):
+            identity = inspect(instance).identity
+            if identity is not None:
+                _defer_row_cache_invalidate(session, instance.__class__, (identity[0],))
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_row_cache(session):
+    """事务提交后失效收集到的行缓存"""
+
+    for model, ident in session.info.pop(_ROW_CACHE_PENDING, ()):
+        row_cache.invalidate(model, ident)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_row_cache(session):
+    """事务回滚后数据未变化,丢弃待失效记录"""
+
+    session.info.pop(_ROW_CACHE_PENDING, None)
+
+
+_archive_metadata = MetaData()
+_archive_tables = dict()  # {表名: 归档表}
 
 
 class Common(object):
@@ -22,7 +267,8 @@ class Common(object):
     status = Column(SmallInteger, default=1)
     create_time = Column(TIMESTAMP, default=datetime.datetime.now)
 
-    _privacy_fields = {'status'}
+    _privacy_fields = {'status'}  # 序列化计划按模型类缓存,运行期间请勿修改
+    _cache_rows = False  # 是否开启主键行缓存,见Common.cached_
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -95,6 +341,180 @@ class Common(object):
 
         db.session.flush()
 
+    @classmethod
+    def _bulk_rows(cls, rows: list) -> list:
+        """整理批量写入的数据
+        只保留模型字段,未提供的字段使用模型声明的默认值(status, create_time等)填充,保证每行字段一致
+        """
+
+        columns = {column.name: column for column in cls.__table__.columns}
+        keys = set()
+        for row in rows:
+            keys.update(key for key in row if key in columns)
+
+        result = list()
+        for row in rows:
+            item = dict()
+            for name, column in columns.items():
+                if name in row:
+                    item[name] = row[name]
+                elif column.default is not None and column.default.is_scalar:
+                    item[name] = column.default.arg
+                elif column.default is not None and column.default.is_callable:
+                    item[name] = column.default.arg(None)
+                elif name in keys:
+                    item[name] = None
+            result.append(item)
+        return result
+
+    @classmethod
+    def _bulk_execute(cls, statement_func, rows: list, chunk_size: int, commit: bool):
+        """按chunk_size分段执行多行INSERT语句
+        :param statement_func: 接收一段数据,返回INSERT语句
+        :return: 新增记录id列表,数据库不支持RETURNING时返回None
+        """
+
+        dialect = db.session().get_bind().dialect
+        returning = getattr(dialect, 'insert_returning', getattr(dialect, 'implicit_returning', False))
+        ids = list() if returning else None
+
+        rows = cls._bulk_rows(rows)
+        for start in range(0, len(rows), chunk_size):
+            statement = statement_func(rows[start:start + chunk_size])
+            if returning:
+                statement = statement.returning(cls.__table__.c.id)
+                ids.extend(row[0] for row in db.session.execute(statement))
+            else:
+                db.session.execute(statement)
+
+        if commit:
+            db.session.commit()
+        return ids
+
+    @classmethod
+    def bulk_insert_(cls, rows: list, chunk_size: int = 1000, commit: bool = True):
+        """批量添加,每chunk_size条数据生成一条多行INSERT语句
+        示例: Model.bulk_insert_([{'name': 'a'}, {'name': 'b'}])
+        :param rows: [{field:value}]
+        :param chunk_size: 每条INSERT语句的最大行数
+        :param commit: 是否在全部写入后提交事务
+        :return: 新增记录id列表,数据库不支持RETURNING时返回None
+        """
+
+        if not rows:
+            return list()
+
+        table = cls.__table__
+        return cls._bulk_execute(lambda chunk: table.insert().values(chunk), rows, chunk_size, commit)
+
+    @classmethod
+    def bulk_upsert_(cls, rows: list, conflict_keys: tuple = ('id',), update_fields: tuple = None,
+                     chunk_size: int = 1000, commit: bool = True):
+        """批量添加或更新
+        MySQL: INSERT ... ON DUPLICATE KEY UPDATE,冲突判断由表的唯一索引决定
+        PostgreSQL/SQLite: INSERT ... ON CONFLICT (conflict_keys) DO UPDATE
+        :param rows: [{field:value}]
+        :param conflict_keys: 唯一约束字段
+        :param update_fields: 冲突时需要更新的字段,默认为除主键与conflict_keys外已提供的全部字段
+        :param chunk_size: 每条INSERT语句的最大行数
+        :param commit: 是否在全部写入后提交事务
+        :return: 新增记录id列表,数据库不支持RETURNING时返回None
+        """
+
+        if not rows:
+            return list()
+
+        dialect_name = db.session().get_bind().dialect.name
+        if dialect_name == 'mysql':
+            from sqlalchemy.dialects.mysql import insert
+        elif dialect_name == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        elif dialect_name == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            raise NotImplementedError(f'bulk_upsert_ 不支持的数据库: {dialect_name}')
+
+        table = cls.__table__
+        if update_fields is None:
+            provided = set()
+            for row in rows:
+                provided.update(row)
+            update_fields = tuple(column.name for column in table.columns
+                                  if column.name in provided and not column.primary_key
+                                  and column.name not in conflict_keys)
+
+        def statement_func(chunk):
+            statement = insert(table).values(chunk)
+            if dialect_name == 'mysql':
+                if not update_fields:
+                    # 只提供了唯一键时不更新任何字段,与DO NOTHING一致;MySQL不接受空的UPDATE子句,使用 id=id
+                    key = table.primary_key.columns.values()[0]
+                    return statement.on_duplicate_key_update({key.name: key})
+                return statement.on_duplicate_key_update({name: statement.inserted[name] for name in update_fields})
+            if not update_fields:
+                return statement.on_conflict_do_nothing(index_elements=list(conflict_keys))
+            return statement.on_conflict_do_update(index_elements=list(conflict_keys),
+                                                   set_={name: statement.excluded[name] for name in update_fields})
+
+        idents = [row['id'] for row in rows if row.get('id') is not None] if cls._cache_rows else []
+        if idents:
+            _defer_row_cache_invalidate(db.session, cls, idents)  # 核心语句不经过flush,提交后失效
+        return cls._bulk_execute(statement_func, rows, chunk_size, commit)
+
+    @classmethod
+    def archive_table(cls) -> Table:
+        """归档表: 原表名_archive,字段与原表一致,不存在时自动创建"""
+
+        table = _archive_tables.get(cls.__table__.name)
+        if table is None:
+            table = Table(f'{cls.__table__.name}_archive', _archive_metadata,
+                          *[column._copy() for column in cls.__table__.columns])
+            table.create(bind=db.session().get_bind(), checkfirst=True)
+            _archive_tables[cls.__table__.name] = table
+        return table
+
+    @classmethod
+    def archive_deleted_(cls, before: datetime.datetime = None, chunk_size: int = 1000, pause: float = 0) -> int:
+        """将逻辑删除(status=0)的记录分批移动到归档表
+        每批在独立的短事务中完成复制与删除,避免长时间锁表,适合在后台任务中执行.
+        :param before: 只归档create_time早于此时间的记录,None为全部
+        :param chunk_size: 每批记录数
+        :param pause: 每批之间的暂停时间,秒
+        :return: 归档的记录数
+        """
+
+        table = cls.__table__
+        archive = cls.archive_table()
+        condition = table.c.status == 0
+        if before is not None:
+            condition = condition & (table.c.create_time < before)
+
+        total = 0
+        while True:
+            # 锁定本批记录(支持的数据库),复制与删除都重复判断条件,期间被恢复的记录不会被归档或删除
+            ids = [row[0] for row in db.session.execute(
+                table.select().with_only_columns(table.c.id).where(condition).order_by(table.c.id)
+                .limit(chunk_size).with_for_update()
+            )]
+            if not ids:
+                break
+
+            chunk_condition = table.c.id.in_(ids) & condition
+            db.session.execute(archive.insert().from_select(
+                [column.name for column in table.columns], table.select().where(chunk_condition)
+            ))
+            result = db.session.execute(table.delete().where(chunk_condition))
+            if cls._cache_rows:
+                _defer_row_cache_invalidate(db.session, cls, ids)
+            db.session.commit()
+
+            total += result.rowcount
+            if len(ids) < chunk_size:
+                break
+            if pause:
+                time.sleep(pause)
+        return total
+
     def set_attrs(self, attrs_dict):
         """批量更新模型的字段数据
         配合WTF表单快速更新模型数据
@@ -108,6 +528,31 @@ class Common(object):
                 setattr(self, key, value)
         return self
 
+    @classmethod
+    def cached_(cls, ident, increase: set = None, remove: set = None):
+        """按主键读取序列化数据,模型开启_cache_rows时先读取缓存
+        返回值与 Model.query.get(ident).serialization(increase, remove) 一致
+        :param ident: 主键值
+        :return: dict({'field_name': field_value}),记录不存在时返回None
+        """
+
+        plan = _compile_serializer_plan(cls, frozenset(), frozenset(), False)
+        values = row_cache.get(cls, ident) if cls._cache_rows else None
+
+        if values is None:
+            # query.get会直接返回identity map中的对象,不经过逻辑删除过滤
+            row = cls.query.filter(cls.id == ident).first()
+            if row is None:
+                return None
+            values = list(row._to_dict_by_plan(plan).values())
+            if cls._cache_rows:
+                row_cache.set(cls, ident, values)
+
+        result = dict(zip((name for name, _ in plan), values))
+        increase = frozenset(increase) if increase else frozenset()
+        remove = frozenset(remove) if remove else frozenset()
+        return {name: result[name] for name, _ in _compile_serializer_plan(cls, increase, remove)}
+
     def to_dict_(self, fields: set = None, funcs: list = None) -> dict:
         """返回字典表数据
         :param funcs: 在序列化后需要被调用的模型方法函数名,通过可变对象dict作为参数传递进函数时,是作为引用对象的特性而实现.
@@ -115,32 +560,35 @@ class Common(object):
         :return: dict({'field_name': field_value})
         """
 
-        result = dict()
-
         # 默认为全字段都是允许序列化的
-        if fields is None:
-            fields = set(self._columns)
+        plan = _compile_serializer_plan(self.__class__, frozenset(), frozenset(), False)
 
-        if funcs is None:
-            funcs = list()
+        if fields is not None:
+            columns = set(name for name, _ in plan)
+            plan = tuple(item for item in plan if item[0] in fields) + \
+                tuple((name, _convert_value) for name in fields if name not in columns)
 
-        for column in fields:
-            value = getattr(self, column)
+        return self._to_dict_by_plan(plan, funcs)
 
-            # 格式化时间类型字段
-            if isinstance(value, datetime.datetime):
-                value = value.strftime('%Y-%m-%d %H:%M:%S')
+    def _to_dict_by_plan(self, plan: tuple, funcs: list = None) -> dict:
+        """按照已编译的序列化计划返回字典表数据
+        :param plan: _compile_serializer_plan 的返回值
+        :param funcs: 序列化后需要调用的函数名与参数
+        """
 
-            # 格式化Decimal类型字段
-            elif isinstance(value, decimal.Decimal):
-                value = float(value)
+        result = dict()
 
+        for column, converter in plan:
+            value = getattr(self, column)
+            if converter is not None:
+                value = converter(value)
             result[column] = value  # 将字段名与字段值关联
 
         # 通过funcs 添加额外的数据内容
-        for func in funcs:
-            func, args, kwargs = func
-            getattr(self, func)(result, *args, **kwargs)
+        if funcs:
+            for func in funcs:
+                func, args, kwargs = func
+                getattr(self, func)(result, *args, **kwargs)
 
         return result
 
@@ -152,25 +600,57 @@ class Common(object):
         :return: dict({'field_name': field_value})
         """
 
-        if increase is None:
-            increase = set()
+        increase = frozenset(increase) if increase else frozenset()
+        remove = frozenset(remove) if remove else frozenset()
 
-        if remove is None:
-            remove = set()
+        plan = _compile_serializer_plan(self.__class__, increase, remove)  # 相同组合直接复用已编译的计划
 
-        if funcs is None:
-            funcs = list()
+        return self._to_dict_by_plan(plan, funcs=funcs)  # 开始序列化
 
-        privacy_fields = copy.copy(self._privacy_fields)  # 拷贝默认隐藏字段,不影响到全局模型的序列化输出
+    @classmethod
+    def serialize_many(cls, rows, increase: set = None, remove: set = None, funcs: list = None) -> list:
+        """批量序列化查询结果,按字段逐列取值与转换
+        rows 可以是模型实例列表,也可以是只查询字段的结果行,示例: db.session.query(Model.id, Model.name).all()
+        结果行只输出查询到的字段,不会实例化ORM对象.
+        :param rows: 模型实例或结果行的列表
+        :param increase: 需要(增加/显示)的序列化输出的字段
+        :param remove: 需要(去除/隐藏)的序列化输出的字段
+        :param funcs: 序列化后需要调用的函数名与参数,仅对模型实例生效
+        :return: [dict({'field_name': field_value})]
+        """
 
-        all_field = set(name.name for name in self.__table__._columns)  # 获得模型所有字段
+        rows = list(rows)
+        if not rows:
+            return list()
 
-        privacy_fields = privacy_fields - increase  # 去除需要被隐藏的字段
-        privacy_fields = privacy_fields | remove  # 追加需要被隐藏的字段
+        increase = frozenset(increase) if increase else frozenset()
+        remove = frozenset(remove) if remove else frozenset()
+        plan = _compile_serializer_plan(cls, increase, remove)
 
-        all_field = all_field - privacy_fields  # 从模型原型所有的可序列化字段中 去除需要被隐藏的字段
+        is_model = isinstance(rows[0], cls)
+        if not is_model:
+            # 结果行只保留查询到的字段
+            row_fields = set(rows[0]._fields)
+            plan = tuple(item for item in plan if item[0] in row_fields)
 
-        return self.to_dict_(fields=all_field, funcs=funcs)  # 开始序列化
+        names = tuple(name for name, _ in plan)
+        columns = list()
+        for name, converter in plan:
+            values = [getattr(row, name) for row in rows]
+            if converter is not None:
+                values = list(map(converter, values))
+            columns.append(values)
+
+        result = [dict(zip(names, values)) for values in zip(*columns)] if columns else [dict() for _ in rows]
+
+        # 通过funcs 添加额外的数据内容
+        if funcs and is_model:
+            for row, item in zip(rows, result):
+                for func in funcs:
+                    func, args, kwargs = func
+                    getattr(row, func)(item, *args, **kwargs)
+
+        return result
 
     @property
     def check_create_time_today(self):
@@ -188,7 +668,7 @@ class Common(object):
         """
 
         self.create_time = datetime.datetime.now()
-        self.direct_update_()
+        self.direct_update_()  # 同时失效主键行缓存
         return self
 
     def __str__(self):
@@ -206,6 +686,7 @@ class Common(object):
 class PasswordModel(object):
     """有密码的模型
     模型必须有self._password字段
+    哈希计算在password_hasher的进程池中执行,校验成功时旧强度的哈希会被替换为当前配置的哈希,需要调用方提交
     """
 
     @property
@@ -217,10 +698,24 @@ class PasswordModel(object):
         """原始密码加密
         :param raw: 用户输入的原始密码
         """
-        self._password = generate_password_hash(raw)
+        self._password = password_hasher.hash(raw)
 
     def check_password(self, raw: str) -> bool:
         """检验用户输入的原始密码
         :param raw: 用户输入的原始密码
         """
-        return check_password_hash(self._password, raw)
+        ok, new_hash = password_hasher.check_and_rehash(self._password, raw)
+        if new_hash is not None:
+            self._password = new_hash
+        return ok
+
+    async def set_password_async(self, raw: str) -> None:
+        """原始密码加密,协程版本"""
+        self._password = await password_hasher.hash_async(raw)
+
+    async def check_password_async(self, raw: str) -> bool:
+        """检验用户输入的原始密码,协程版本"""
+        ok, new_hash = await password_hasher.check_and_rehash_async(self._password, raw)
+        if new_hash is not None:
+            self._password = new_hash
+        return ok
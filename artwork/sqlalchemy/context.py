@@ -1,14 +1,128 @@
 """DB对象上下文相关"""
 
+import os
+import threading
 from functools import wraps
+from contextlib import contextmanager
+from flask import g, has_app_context
+from artwork.sqlalchemy import instrument
+from artwork.sqlalchemy.base_model import db
+
+_local = threading.local()  # 每个线程: pid, app上下文, db_session嵌套层数
+
+
+def worker_context():
+    """当前工作进程(线程)的app上下文,首次调用时创建并push,之后的任务复用
+    fork后的子进程会重新创建
+    """
+    pid = os.getpid()
+    if getattr(_local, 'pid', None) != pid:
+        # 伪代码: app = Flask()
+        app = """from run_celery import app"""
+        _local.context = app.app_context()
+        _local.context.push()
+        _local.pid = pid
+        _local.depth = 0
+    return _local.context
+
+
+def _in_outer_context() -> bool:
+    """当前线程是否处于其他的app上下文中(例如在视图中直接调用,或celery的eager任务)"""
+    if not has_app_context():
+        return False
+    context = getattr(_local, 'context', None)
+    return context is None or g._get_current_object() is not context.g
 
 
 def db_session(func):
+    """任务装饰器,在工作进程的app上下文中执行
+    任务结束后回滚未提交的事务并关闭session,并清空g,下一个任务使用新的session与g;嵌套调用时由最外层负责
+    已处于其他app上下文(例如请求)中时直接在该上下文中执行,session与g由该上下文负责清理
+    """
+
     @wraps(func)
     def inner(*args, **kwargs):
-        # 伪代码: app = Flask()
-        app = """from run_celery import app"""
-        with app.app_context():
+        if _in_outer_context():
+            return func(*args, **kwargs)
+
+        worker_context()
+        if _local.depth:
             return func(*args, **kwargs)
 
-    return inner
\ No newline at end of file
+        _local.depth += 1
+        try:
+            with instrument.collect(func.__qualname__):
+                return func(*args, **kwargs)
+        finally:
+            _local.depth -= 1
+            db.session.remove()
+            # app上下文在任务间复用,清空g,避免上一个任务的g.user等数据被下一个任务读取
+            context = _local.context
+            context.g = context.app.app_ctx_globals_class()
+
+    return inner
+
+
+class SessionScope:
+    """批量写入时的session包装,见session_scope"""
+
+    def __init__(self, session, commit_every: int, flush_every: int, max_identity: int):
+        self.session = session
+        self.commit_every = commit_every
+        self.flush_every = flush_every
+        self.max_identity = max_identity
+        self.count = 0  # 累计操作数
+        self.commits = 0
+
+    def add(self, instance):
+        """添加对象并计数"""
+        self.session.add(instance)
+        self.step()
+
+    def add_all(self, instances):
+        for instance in instances:
+            self.add(instance)
+
+    def step(self, count: int = 1):
+        """计数count次操作,达到阈值时flush或commit
+        直接修改已加载对象等不经过add的操作,调用方需要自行调用step
+        """
+        before = self.count
+        self.count += count
+        if self.commit_every and self.count // self.commit_every != before // self.commit_every:
+            self.commit()
+        elif self.flush_every and self.count // self.flush_every != before // self.flush_every:
+            self.session.flush()
+
+        if self.max_identity and len(self.session.identity_map) > self.max_identity:
+            # 先写入当前事务,再清空session,已加载的对象不再被session持有
+            self.session.flush()
+            self.session.expunge_all()
+
+    def commit(self):
+        self.session.commit()
+        self.commits += 1
+
+
+@contextmanager
+def session_scope(commit_every: int = 1000, flush_every: int = 100, max_identity: int = 10000, session=None):
+    """批量写入,每flush_every次操作flush,每commit_every次操作commit,结束时提交剩余部分,异常时回滚未提交部分
+    identity map中的对象超过max_identity时清空session,长时间运行的任务内存不会持续增长
+    示例:
+        with session_scope(commit_every=500) as scope:
+            for row in rows:
+                scope.add(Model(**row))
+    :param commit_every: 提交间隔,0为只在结束时提交
+    :param flush_every: flush间隔,0为不单独flush
+    :param max_identity: identity map对象数上限,0为不限制
+    :param session: 默认为db.session
+    """
+
+    session = session if session is not None else db.session
+    scope = SessionScope(session, commit_every, flush_every, max_identity)
+    try:
+        yield scope
+        scope.commit()
+    except BaseException:
+        session.rollback()
+        raise
@@ -0,0 +1,161 @@
+"""SQL执行统计与N+1查询检测
+每个Flask请求或db_session任务内,记录SQL执行次数,总耗时与单条语句耗时,
+相同语句重复执行次数超过阈值时视为可能的N+1查询.
+未调用init_app时不注册任何数据库事件,没有额外开销.
+示例:
+    instrument.init_app(app, n_plus_one_threshold=5, header=app.debug)
+    instrument.add_hook(lambda stats: logger.info(stats.summary()))
+"""
+import re
+import time
+import contextvars
+from contextlib import contextmanager
+from flask import g
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_PLACEHOLDER_LIST = re.compile(r'\(\s*(?:\?|%s|%\(\w+\)s|:\w+)(?:\s*,\s*(?:\?|%s|%\(\w+\)s|:\w+))*\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+_current = contextvars.ContextVar('sql_stats', default=None)
+
+enabled = False  # init_app后为True
+threshold = 5  # 同一语句在一次请求内执行次数达到此值时视为可能的N+1查询
+_hooks = list()
+
+
+def fingerprint(statement: str) -> str:
+    """语句指纹: 合并空白,IN列表等参数占位符列表归一为(?)"""
+    return _PLACEHOLDER_LIST.sub('(?)', _WHITESPACE.sub(' ', statement).strip())
+
+
+class SQLStats:
+    """一次请求或任务内的SQL统计"""
+
+    def __init__(self, name: str = None):
+        self.name = name
+        self.count = 0
+        self.total_time = 0.0
+        self.statements = dict()  # {fingerprint: [执行次数, 总耗时, 最长耗时]}
+
+    def record(self, statement: str, elapsed: float):
+        self.count += 1
+        self.total_time += elapsed
+        key = fingerprint(statement)
+        item = self.statements.get(key)
+        if item is None:
+            self.statements[key] = [1, elapsed, elapsed]
+        else:
+            item[0] += 1
+            item[1] += elapsed
+            if elapsed > item[2]:
+                item[2] = elapsed
+
+    def n_plus_one(self, limit: int = None) -> list:
+        """可能的N+1查询
+        :return: [(fingerprint, 执行次数, 总耗时)] 按执行次数倒序
+        """
+        limit = threshold if limit is None else limit
+        result = [(key, item[0], item[1]) for key, item in self.statements.items()
+                  if item[0] >= limit and key[:6].upper() == 'SELECT']
+        return sorted(result, key=lambda x: x[1], reverse=True)
+
+    def summary(self) -> dict:
+        return {
+            'name': self.name,
+            'count': self.count,
+            'total_ms': round(self.total_time * 1000, 3),
+            'n_plus_one': [{'statement': key, 'count': count, 'total_ms': round(total * 1000, 3)}
+                           for key, count, total in self.n_plus_one()]
+        }
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        context._artwork_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    if stats is not None:
+        start = getattr(context, '_artwork_start', None)
+        if start is not None:
+            stats.record(statement, time.perf_counter() - start)
+
+
+def current() -> SQLStats:
+    """当前请求或任务的统计,未开启时返回None"""
+    return _current.get()
+
+
+def add_hook(func):
+    """请求或任务结束时调用,参数为SQLStats"""
+    _hooks.append(func)
+    return func
+
+
+def _report(stats: SQLStats):
+    for hook in _hooks:
+        hook(stats)
+
+
+@contextmanager
+def collect(name: str = None):
+    """统计代码块内的SQL执行,未开启时不做任何事
+    :param name: 任务名称
+    """
+    if not enabled:
+        yield None
+        return
+    stats = SQLStats(name)
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+        _report(stats)
+
+
+def init_app(app, n_plus_one_threshold: int = 5, header: bool = None):
+    """开启SQL统计
+    :param app: Flask
+    :param n_plus_one_threshold: N+1判断阈值
+    :param header: 是否在响应头中返回统计信息,默认在debug模式下开启
+    """
+    global enabled, threshold
+    threshold = n_plus_one_threshold
+    if header is None:
+        header = app.debug
+
+    if not enabled:
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        enabled = True
+
+    @app.before_request
+    def _start():
+        stats = SQLStats()
+        g._sql_stats_token = _current.set(stats)
+
+    @app.after_request
+    def _finish(response):
+        stats = _current.get()
+        if stats is not None:
+            if header:
+                response.headers['X-SQL-Count'] = str(stats.count)
+                response.headers['X-SQL-Time'] = f'{stats.total_time * 1000:.3f}ms'
+                suspects = stats.n_plus_one()
+                if suspects:
+                    response.headers['X-SQL-N-Plus-One'] = str(len(suspects))
+        return response
+
+    @app.teardown_request
+    def _teardown(exc):
+        token = g.pop('_sql_stats_token', None)
+        if token is not None:
+            stats = _current.get()
+            _current.reset(token)
+            if stats is not None:
+                from flask import request
+                stats.name = f'{request.method} {request.path}'
+                _report(stats)
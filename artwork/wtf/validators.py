@@ -1,12 +1,14 @@
-import json
+import functools
 import wtforms
-from flask import request
+from flask import request, current_app
+from werkzeug.datastructures import MultiDict, CombinedMultiDict
 from flask_wtf import FlaskForm
 from wtforms import widgets
 from wtforms.compat import text_type
 from wtforms import Field, ValidationError
+from wtforms.fields.core import UnboundField
 from wtforms.validators import InputRequired as InputRequiredBase, StopValidation, NumberRange, DataRequired
-from artwork.common import error
+from artwork.common import error, json_codec
 
 messages = {
     'required': '{}是必须填写的,请填写后重试!',
@@ -47,6 +49,161 @@ class BaseForm(FlaskForm):
             else:
                 return self
 
+    @classmethod
+    def fast_validate_(cls, formdata=None) -> dict:
+        """表单快速验证,不实例化表单,直接返回字段数据字典表
+        适用于关闭CSRF的JSON接口.字段与验证器在每个表单类首次调用时编译为验证计划,
+        错误信息与validate_一致;含有不支持的字段,验证器或开启CSRF时,使用validate_完整验证.
+        :param formdata: 请求参数,默认GET请求为request.args,其他请求为表单或json数据
+        :return: {field_name: data}
+        """
+
+        if formdata is None:
+            formdata = _request_formdata()
+
+        plan = _compile_validation_plan(cls)
+        if plan is None or _csrf_enabled(cls):
+            # 与验证计划使用相同的请求参数,GET请求同样读取request.args
+            return cls(formdata).validate_().data
+
+        result = dict()
+        errors = dict()
+        for name, kind, default, validators in plan:
+            field_errors = list()
+            data = default
+            raw_data = None
+            if formdata is not None:
+                raw_data = formdata.getlist(name) if name in formdata else []
+                if kind == _JSON:
+                    data = raw_data
+                elif raw_data:
+                    if kind == _STRING:
+                        data = raw_data[0]
+                    else:
+                        try:
+                            data = int(raw_data[0])
+                        except ValueError:
+                            data = None
+                            field_errors.append('Not a valid integer value')
+
+            for validator in validators:
+                rule = validator[0]
+                if rule == _INPUT_REQUIRED:
+                    if not raw_data or (raw_data[0] is None or raw_data[0] == ''):
+                        field_errors = [validator[1]] if validator[1] else []
+                        break
+                elif rule == _DATA_REQUIRED:
+                    if not data or isinstance(data, str) and not data.strip():
+                        field_errors = [validator[1]] if validator[1] else []
+                        break
+                elif rule == _NUMBER_RANGE:
+                    minimum, maximum = validator[1], validator[2]
+                    if data is None or (minimum is not None and data < minimum) or \
+                            (maximum is not None and data > maximum):
+                        field_errors.append(validator[3])
+
+            result[name] = data
+            if field_errors:
+                errors[name] = field_errors
+
+        if errors:
+            raise error.FormException(error_code=1001, message='请求参数错误.', error_fields=errors)
+        return result
+
+
+_STRING, _INTEGER, _JSON = 1, 2, 3
+_INPUT_REQUIRED, _DATA_REQUIRED, _NUMBER_RANGE = 1, 2, 3
+
+
+def _csrf_enabled(form_class) -> bool:
+    """表单是否开启CSRF,表单Meta中的csrf设置优先于WTF_CSRF_ENABLED配置"""
+    for klass in form_class.__mro__:
+        meta = klass.__dict__.get('Meta')
+        if meta is not None and 'csrf' in vars(meta):
+            csrf = vars(meta)['csrf']
+            if not isinstance(csrf, property):
+                return bool(csrf)
+            break
+    return current_app.config.get('WTF_CSRF_ENABLED', True)
+
+
+def _request_formdata():
+    """fast_validate_的请求数据来源
+    GET请求使用request.args(FlaskForm对GET请求不读取任何数据,这里不同),其他请求与FlaskForm一致
+    """
+    if request.method == 'GET':
+        return request.args
+    if request.files:
+        return CombinedMultiDict((request.files, request.form))
+    if request.form:
+        return request.form
+    if request.is_json:
+        return MultiDict(request.get_json())
+    return None
+
+
+def _compile_validator(validator):
+    """编译单个验证器,不支持时返回None"""
+    if isinstance(validator, InputRequired):
+        return _INPUT_REQUIRED, validator.message if validator.message is not None else 'This field is required.'
+    if type(validator) is DataRequired:
+        return _DATA_REQUIRED, validator.message if validator.message is not None else 'This field is required.'
+    if type(validator) is NumberRange:
+        message = validator.message
+        if message is None:
+            if validator.max is None:
+                message = 'Number must be at least %(min)s.'
+            elif validator.min is None:
+                message = 'Number must be at most %(max)s.'
+            else:
+                message = 'Number must be between %(min)s and %(max)s.'
+        return _NUMBER_RANGE, validator.min, validator.max, message % dict(min=validator.min, max=validator.max)
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def _compile_validation_plan(form_class):
+    """编译表单验证计划
+    :return: ((name, kind, default, validators), ...) 按字段声明顺序排列,不支持快速验证时返回None
+    """
+
+    kinds = {StringField: _STRING, JsonField: _JSON, wtforms.IntegerField: _INTEGER}
+    unbound_fields = list()
+    for name in dir(form_class):
+        if name.startswith('_'):
+            continue
+        unbound = getattr(form_class, name)
+        if isinstance(unbound, UnboundField):
+            if hasattr(form_class, f'validate_{name}'):
+                return None  # 表单内联验证器需要表单实例
+            unbound_fields.append((unbound.creation_counter, name, unbound))
+
+    plan = list()
+    for _, name, unbound in sorted(unbound_fields):
+        kind = kinds.get(unbound.field_class)
+        kwargs = unbound.kwargs
+        if kind is None or unbound.args[1:] or kwargs.get('filters') or set(kwargs) - {'validators', 'default'}:
+            return None
+
+        validators = list()
+        for validator in kwargs.get('validators') or ():
+            compiled = _compile_validator(validator)
+            if compiled is None:
+                return None
+            validators.append(compiled)
+
+        default = kwargs.get('default')
+        if callable(default):
+            return None  # 每次请求都需要重新计算默认值
+        if kind == _INTEGER and default is not None:
+            try:
+                default = int(default)
+            except (ValueError, TypeError):
+                return None
+
+        plan.append((name, kind, default, tuple(validators)))
+    return tuple(plan)
+
 
 class StringField(Field):
     """
@@ -77,7 +234,7 @@ class JsonField(Field):
             self.data = data
         else:
             try:
-                self.data = json.loads(data)
+                self.data = json_codec.loads(data)
             except BaseException:
                 raise ValidationError('value to json error')
 
@@ -109,3 +266,14 @@ class ListPage:
     ],
         default=10
     )
+
+
+class CursorPage:
+    """游标分页,配合public.query_keyset使用"""
+    cursor = StringField(default=None)
+
+    limit = wtforms.IntegerField(validators=[
+        NumberRange(min=1, max=50, message=ValidatorsMessage.say('system_number', 1, 50))
+    ],
+        default=10
+    )
@@ -0,0 +1,26 @@
+"""JSON编解码测试"""
+import pytest
+from artwork.common import json_codec
+
+
+@pytest.mark.parametrize('value', [2 ** 64, -2 ** 64 - 1, 123456789012345678901234567890])
+def test_loads_big_int(value):
+    assert json_codec.loads(f'{{"id":{value}}}') == {'id': value}
+    assert json_codec.loads(f'[{value}]'.encode()) == [value]
+
+
+def test_loads_round_trip():
+    data = {'id': 2 ** 70, 'amount': 1.5, 'name': '中文', 'items': [1, 2 ** 63 - 1, -2 ** 63]}
+    assert json_codec.loads(json_codec.dumps(data)) == data
+    assert json_codec.loads(bytearray(json_codec.dumps_bytes(data))) == data
+
+
+@pytest.mark.parametrize('raw, expected', [
+    ('{"out_trade_no":"202610181234567890123456"}', False),
+    (f'{{"id": {2 ** 64}}}', True),
+    (f'[1,-{2 ** 64}]', True),
+    (f' {2 ** 64}', True),
+])
+def test_long_number_detection(raw, expected):
+    """只有字符串外的长数字才使用标准库解码"""
+    assert json_codec._has_long_number(raw) is expected
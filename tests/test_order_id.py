@@ -0,0 +1,85 @@
+"""订单编号生成器测试"""
+import os
+import multiprocessing
+import warnings
+import pytest
+from artwork.common import public
+
+PROCESSES = 8
+IDS_PER_PROCESS = 20000
+
+
+def _generate(worker_id: int) -> list:
+    public.init_order_id(worker_id)
+    return [public.generate_order_id() for _ in range(IDS_PER_PROCESS)]
+
+
+def test_multi_process_unique():
+    context = multiprocessing.get_context('fork')
+    with context.Pool(PROCESSES) as pool:
+        results = pool.map(_generate, range(PROCESSES))
+
+    ids = [order_id for result in results for order_id in result]
+    assert len(ids) == len(set(ids)) == PROCESSES * IDS_PER_PROCESS
+    assert all(len(order_id) == 24 and order_id.isdigit() for order_id in ids)
+    for result in results:
+        assert result == sorted(result)
+
+
+def test_worker_id_not_inherited_after_fork():
+    generator = public.OrderIdGenerator(worker_id=7)
+    reader, writer = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.write(writer, str(int(generator.configured)).encode())
+        os._exit(0)
+    os.waitpid(pid, 0)
+    assert os.read(reader, 1) == b'0'
+    assert generator.worker_id == 7
+
+
+def _generate_default(_) -> list:
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return public.order_id_generator.configured, [public.generate_order_id() for _ in range(IDS_PER_PROCESS)]
+
+
+def test_env_worker_id_not_inherited_after_fork(monkeypatch):
+    monkeypatch.setenv(public.ORDER_ID_WORKER_ENV, '7')
+    context = multiprocessing.get_context('fork')
+    with context.Pool(4) as pool:
+        results = pool.map(_generate_default, range(4))
+
+    assert not any(configured for configured, _ in results)
+    ids = [order_id for _, result in results for order_id in result]
+    assert len(ids) == len(set(ids))
+
+
+def test_worker_id_from_env(monkeypatch):
+    monkeypatch.setenv(public.ORDER_ID_WORKER_ENV, '42')
+    generator = public.OrderIdGenerator()
+    assert generator.configured
+    assert generator.generate()[17:21] == '0042'
+
+
+def test_unconfigured_warns(monkeypatch):
+    monkeypatch.delenv(public.ORDER_ID_WORKER_ENV, raising=False)
+    generator = public.OrderIdGenerator()
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        generator.generate()
+        generator.generate()
+    assert len([w for w in caught if issubclass(w.category, RuntimeWarning)]) == 1
+
+
+def test_invalid_worker_id():
+    with pytest.raises(ValueError):
+        public.init_order_id(10000)
+
+
+def test_clock_regression(monkeypatch):
+    generator = public.OrderIdGenerator(worker_id=1)
+    first = generator.generate()
+    monkeypatch.setattr(public.time, 'time', lambda: 0.0)
+    second = generator.generate()
+    assert second > first